@@ -0,0 +1,112 @@
+""" plays out what the farmer does, one action at a time, so that the
+player can see their program working through the furrows """
+from collections import deque, namedtuple
+import math
+
+from config import *
+
+# kind: 'move' to walk to target (grid coords), or an action done on the
+# spot, such as 'water', which takes ACTION_TIME
+# on_done: called when the action is complete, eg to change a tile
+Action = namedtuple('Action', ['kind', 'target', 'on_done'])
+
+
+class Animator:
+    """ a queue of actions for a character.
+    The interpreter adds actions as the program runs, and update() is
+    called once per frame to move the character smoothly between tiles.
+    The program can run a few actions ahead of the animation (see
+    busy()), but no further, so what is on screen keeps up with the code.
+    In fast-forward mode, or if the queue gets too long, actions are
+    completed straight away instead of being animated. """
+
+    def __init__(self, character, speed=FARMER_SPEED,
+                 action_time=ACTION_TIME, pipeline=ANIMATION_PIPELINE,
+                 max_queue=ANIMATION_MAX_QUEUE):
+        self.character = character
+        self.speed = speed  # tiles per second
+        self.action_time = action_time  # seconds for each non-move action
+        self.pipeline = pipeline
+        self.max_queue = max_queue
+        self.fast_forward = ANIMATION_FAST_FORWARD
+        self.queue = deque()  # the first action is the one in progress
+        self.elapsed = 0.0  # seconds spent on the current action
+
+    def move(self, target: Point):
+        """ walk to the target tile """
+        # every move is kept, even several in a row, so that a program
+        # reading along a furrow sees the farmer visit each plot
+        if target != self.get_final_position():
+            self.add(Action('move', target, None))
+
+    def act(self, kind, target: Point, on_done=None):
+        """ do something (eg 'water') to the tile at target """
+        self.add(Action(kind, target, on_done))
+
+    def add(self, action):
+        self.queue.append(action)
+        # a program that changes the furrows in a tight loop could queue
+        # more actions than could ever be watched, so the oldest are
+        # skipped
+        while len(self.queue) > self.max_queue:
+            self.finish(self.queue.popleft())
+
+    def get_final_position(self) -> Point:
+        # where the character will be once the queued moves are done
+        for action in reversed(self.queue):
+            if action.kind == 'move':
+                return action.target
+        return self.character.position
+
+    def update(self, seconds):
+        """ plays the queued actions for this many seconds """
+        if self.fast_forward:
+            self.skip()
+            return
+        while self.queue and seconds > 0:
+            action = self.queue[0]
+            if action.kind == 'move':
+                seconds = self.walk(action.target, seconds)
+            else:
+                self.elapsed += seconds
+                seconds = self.elapsed - self.action_time
+            if seconds >= 0:
+                # the action is complete, and any time left over is
+                # used for the next one
+                self.finish(self.queue.popleft())
+
+    def walk(self, target: Point, seconds) -> float:
+        # moves the character towards the target for up to this many
+        # seconds. Returns the time left over if the target is reached,
+        # or -1 if not
+        position = self.character.position
+        dx = target.x - position.x
+        dy = target.y - position.y
+        distance = math.hypot(dx, dy)
+        travel = self.speed * seconds
+        if travel >= distance:
+            return seconds - distance / self.speed
+        self.character.position = Point(position.x + dx * travel / distance,
+                                        position.y + dy * travel / distance)
+        return -1
+
+    def finish(self, action):
+        # completes an action, whether or not it has been animated
+        if action.kind == 'move':
+            self.character.position = action.target
+        elif action.on_done is not None:
+            action.on_done()
+        self.elapsed = 0.0
+
+    def skip(self):
+        """ completes all the queued actions straight away """
+        while self.queue:
+            self.finish(self.queue.popleft())
+
+    def busy(self) -> bool:
+        # true if the program has got far enough ahead of the animation
+        # that it should wait for it to catch up
+        return not self.fast_forward and len(self.queue) >= self.pipeline
+
+    def __len__(self):
+        return len(self.queue)
@@ -0,0 +1,178 @@
+""" runs a folder full of saved farm programs and records what each one did.
+Usage: python batch_grader.py FOLDER [-o results.jsonl]
+Each program is run in its own headless world, and the programs are
+shared out between several processes, so that a whole class set can be
+marked in one go. Use -h to see the other options.
+The results file has one JSON object per line, in the same order as the
+program files, eg
+{"file": "alice.py", "success": true, "output": ["hello"], "errors": [],
+ "instructions": 123, "seconds": 0.001, "furrows": {...}}
+"""
+import argparse
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+from config import *
+from farm_interpreter import convert_to_lines
+from furrow import GrowingPlot
+from headless import HeadlessWorld
+
+
+def furrow_state(furrow) -> list:
+    # the contents of each element of a furrow, as JSON-friendly values
+    # the program might have put anything in the furrow, not just plots
+    state = []
+    for index, element in enumerate(furrow):
+        if isinstance(element, GrowingPlot):
+            state.append({'coords': list(element.coords),
+                          'water': element.water})
+        else:
+            # the tile the element is on, if there is one
+            tile = furrow.get_tile(index)
+            state.append({'coords': None if tile is None else list(tile),
+                          'water': None, 'value': repr(element)})
+    return state
+
+
+def grade_file(filename, max_instructions=GRADER_MAX_INSTRUCTIONS,
+               time_limit=GRADER_TIME_LIMIT, inputs=()) -> dict:
+    """ runs one saved program and returns a dict describing what
+    happened. Any problem with the program itself is recorded in the
+    result, rather than raised, so one bad file can't spoil a batch """
+    result = {'file': os.path.basename(filename)}
+    start = time.perf_counter()
+    world = None
+    try:
+        with open(filename, 'r') as file:
+            # the same format that FarmCodeWindow saves
+            source = convert_to_lines(file.read().splitlines())
+        world = HeadlessWorld(inputs=inputs)
+        vm = world.farmer.python_interpreter
+        vm.max_instructions = max_instructions
+        vm.max_run_time = time_limit
+        success, errors = world.run_program(source)
+        if success:
+            errors = []  # on success, run() gives the return value
+        elif isinstance(errors, str):  # compile errors come as a string
+            errors = [errors] if errors else []
+        result['success'] = bool(success)
+        result['output'] = world.farmer.output
+        result['errors'] = [str(e) for e in errors]
+        result['instructions'] = vm.instruction_count
+    except Exception as e:
+        result['success'] = False
+        result['errors'] = ["grader failed: " + repr(e)]
+        world = None
+    if world is not None:
+        # recording the furrows is kept separate, so that if it goes
+        # wrong it doesn't change the outcome of the program itself
+        try:
+            result['furrows'] = {f.name: furrow_state(f)
+                                 for f in world.furrows}
+        except Exception as e:
+            result['furrows'] = None
+            result['grader_error'] = "couldn't record the furrows: " + repr(e)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def timed_out(filename, limit) -> dict:
+    # the result for a program whose process had to be killed
+    return {'file': os.path.basename(filename),
+            'success': False,
+            'output': [],
+            'errors': ["the program was stopped after {0:g}".format(limit)
+                       + " seconds. Is there a calculation that never ends?"],
+            'furrows': None,
+            'seconds': limit}
+
+
+def grade_folder(folder, output_file, pattern='*.py', processes=None,
+                 wall_clock_limit=GRADER_WALL_CLOCK_LIMIT, **limits) -> int:
+    """ grades every program in the folder that matches the pattern,
+    and writes the results to output_file.
+    Returns the number of programs graded """
+    filenames = sorted(glob.glob(os.path.join(folder, pattern)))
+    grade = functools.partial(grade_file, **limits)
+    finished = {}  # filename: result, for programs that finished early
+    count = 0
+    with open(output_file, 'w') as results:
+        while count < len(filenames):
+            # the results are written in the same order as the files.
+            # The interpreter's limits are only checked between batches of
+            # bytecodes, so a single huge calculation (eg 10**10**8) can't
+            # be stopped from inside. If a program takes longer than
+            # wall_clock_limit, the only way to stop it is to kill the
+            # pool, so the rest of the programs are run in a new one
+            with multiprocessing.Pool(processes) as pool:
+                jobs = {filename: pool.apply_async(grade, (filename,))
+                        for filename in filenames[count:]
+                        if filename not in finished}
+                for filename in filenames[count:]:
+                    stuck = False
+                    if filename in finished:
+                        result = finished.pop(filename)
+                    else:
+                        try:
+                            # the program might have started before we
+                            # began waiting, so it gets at least this long
+                            result = jobs[filename].get(wall_clock_limit)
+                        except multiprocessing.TimeoutError:
+                            result = timed_out(filename, wall_clock_limit)
+                            stuck = True
+                    results.write(json.dumps(result) + '\n')
+                    count += 1
+                    if stuck:
+                        # keep anything that has already finished, then
+                        # leaving the with block kills the pool
+                        for later in filenames[count:]:
+                            job = jobs.get(later)
+                            if job is not None and job.ready():
+                                finished[later] = job.get()
+                        break
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run saved farm programs and record the results.")
+    parser.add_argument('folder', help="folder containing the programs")
+    parser.add_argument('-o', '--output', default='results.jsonl',
+                        help="results file (default: results.jsonl)")
+    parser.add_argument('-p', '--pattern', default='*.py',
+                        help="which files to run (default: *.py)")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="number of processes (default: one per core)")
+    parser.add_argument('--max-instructions', type=int,
+                        default=GRADER_MAX_INSTRUCTIONS,
+                        help="stop each program after this many bytecodes")
+    parser.add_argument('--time-limit', type=float,
+                        default=GRADER_TIME_LIMIT,
+                        help="stop each program after this many seconds")
+    parser.add_argument('--wall-clock-limit', type=float,
+                        default=GRADER_WALL_CLOCK_LIMIT,
+                        help="kill any program still running after this"
+                             " many seconds")
+    parser.add_argument('--input', action='append', default=[],
+                        dest='inputs',
+                        help="an answer for input() (repeat for more)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = grade_folder(args.folder, args.output,
+                         pattern=args.pattern,
+                         processes=args.processes,
+                         wall_clock_limit=args.wall_clock_limit,
+                         max_instructions=args.max_instructions,
+                         time_limit=args.time_limit,
+                         inputs=args.inputs)
+    print("Graded {0} programs in {1:.1f}s, results in {2}".format(
+        count, time.perf_counter() - start, args.output))
+
+
+if __name__ == '__main__':
+    main()
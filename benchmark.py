@@ -0,0 +1,79 @@
+""" measures how fast the interpreter runs some typical student programs.
+Run it directly: python benchmark.py
+The programs run in a headless world, which draws nothing, and the whole
+program is run in one go, so that the timings only reflect the cost of
+executing bytecode.
+Each program is timed with and without superinstructions
+(see VirtualMachine.fuse_instructions)."""
+import time
+
+from headless import HeadlessWorld
+
+# a few programs that resemble what students write
+PROGRAMS = {
+    'counting loop':
+        "total = 0\n"
+        "for i in range(20000):\n"
+        "    total += i\n",
+    'while loop':
+        "i = 0\n"
+        "while i < 10000:\n"
+        "    i += 1\n",
+    'watering':
+        "for day in range(500):\n"
+        "    for i in range(len(row1)):\n"
+        "        water = row1[i].water\n"
+        "        if water < 3:\n"
+        "            print(i)\n",
+    'furrow access':
+        "n = 0\n"
+        "for repeat in range(2000):\n"
+        "    for i in range(len(row1)):\n"
+        "        plot = row1[i]\n"
+        "        n = n + 1\n",
+    'function calls':
+        "def double(a):\n"
+        "    return a * 2\n"
+        "x = 0\n"
+        "for i in range(3000):\n"
+        "    x = x + double(i)\n",
+    'local variables':
+        "def total(n):\n"
+        "    t = 0\n"
+        "    for i in range(n):\n"
+        "        t += i\n"
+        "    return t\n"
+        "x = total(20000)\n",
+}
+
+
+def time_program(source, optimise=True, repeats=3):
+    # returns the best time, in seconds, over several runs
+    best = None
+    for repeat in range(repeats):
+        vm = HeadlessWorld().farmer.python_interpreter
+        vm.optimise = optimise
+        vm.load(source.split('\n'))
+        vm.compile()
+        start = time.perf_counter()
+        vm.run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    # superinstructions mean fewer (bigger) instructions, so the two
+    # versions are compared by how long they take, not bytecodes/sec
+    print("{0:<20}{1:>12}{2:>12}{3:>10}".format(
+        '', 'unfused ms', 'fused ms', 'speedup'))
+    for name, source in PROGRAMS.items():
+        unfused = time_program(source, optimise=False)
+        fused = time_program(source, optimise=True)
+        print("{0:<20}{1:>12.1f}{2:>12.1f}{3:>9.2f}x".format(
+            name, unfused * 1000, fused * 1000, unfused / fused))
+
+
+if __name__ == '__main__':
+    main()
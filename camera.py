@@ -1,7 +1,20 @@
 # handles the relative viewpoint offset,
 # rotation and zoom for the terrain
+import math
+
 import pygame
 
+from config import ZOOM_STEP, MIN_ZOOM, MAX_ZOOM
+
+
+def quantise_zoom(zoom):
+    # snap a zoom factor to the nearest zoom level (a whole number of
+    # ZOOM_STEPs) within the allowed range. There are only a few dozen
+    # levels, so anything rendered for a level can be cached and reused
+    zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+    level = round(math.log(zoom, ZOOM_STEP))
+    return ZOOM_STEP ** level
+
 
 class Camera:
     def __init__(self):
@@ -0,0 +1,61 @@
+""" collects changes made to the furrows by the player's program, so that
+the world can show them on screen once per frame """
+from collections import namedtuple
+
+# furrow: the Furrow that changed
+# index: position of the element in the furrow, or None if a plot has
+#        been taken out of its furrow
+# field: what changed, eg 'water', or 'plot' if the element at index
+#        was replaced, added, removed or moved, or 'read' if the
+#        program has just looked at it
+# old, new: the value before and after
+# plot: the GrowingPlot whose field changed, or None for 'plot' changes
+Change = namedtuple('Change', ['furrow', 'index', 'field', 'old', 'new',
+                               'plot'])
+
+
+class ChangeQueue:
+    """ a batch of changes waiting to be shown.
+    Repeated changes to the same field of the same plot are merged, so
+    a loop that waters one plot a hundred times in a frame only
+    produces one change, from the first old value to the last new one.
+    The world calls drain() once per frame, so the cost of keeping the
+    screen up to date depends on how much was changed, not on how big
+    the farm is. """
+
+    def __init__(self, listener=None):
+        self.pending = {}  # see put() for the keys
+        # called whenever a change is queued, eg to make the
+        # interpreter hand control back to the game loop
+        self.listener = listener
+        # whether reading a furrow counts as a change
+        self.track_reads = True
+
+    def put(self, furrow, index, field, old, new, plot=None):
+        # changes to a plot are merged by plot, wherever it is now, and
+        # changes to the furrow itself by position
+        if plot is None:
+            key = (id(furrow), index, field)
+        else:
+            key = (id(plot), field)
+        if field == 'read':
+            # the farmer should end up where the program looked last,
+            # so an earlier read of the same element is moved to the end
+            self.pending.pop(key, None)
+        earlier = self.pending.get(key)
+        if earlier is not None:
+            old = earlier.old
+        self.pending[key] = Change(furrow, index, field, old, new, plot)
+        if self.listener is not None:
+            self.listener()
+
+    def drain(self) -> list:
+        # returns the changes queued since the last call, oldest first
+        # dicts keep their insertion order, so merged changes stay
+        # where they first happened
+        changes = list(self.pending.values())
+        self.pending = {}
+        return changes
+
+    def __len__(self):
+        return len(self.pending)
@@ -5,9 +5,11 @@ import pygame
 
 import farm_interpreter
 import spritesheet
+from camera import quantise_zoom
 from config import *
 from console_messages import console_msg
 from farm_interpreter import VirtualMachine
+from surface_cache import SurfaceCache
 from terrain import Terrain
 from text_panel import SpeechBubble
 
@@ -19,10 +21,15 @@ class Character:
                  start_position: Point, zoom):
         self.name = name
         self.world = world
-        raw_sprites = spritesheet.SpriteSheet(image_file, 1, 3, 1)
-        self._sprite = raw_sprites.sprites[1][0]
+        # characters in a headless world have no image_file, and no sprite
+        if image_file is None:
+            self._sprite = None
+        else:
+            raw_sprites = spritesheet.SpriteSheet(image_file, 1, 3, 1)
+            self._sprite = raw_sprites.sprites[1][0]
         self._zoomed_sprite = None
         self._magnification = 1.0
+        self._sprite_cache = SurfaceCache(SPRITE_CACHE_PIXELS)
         self.change_zoom(zoom)
         self.position = start_position  # grid coords on the terrain
         self.facing = "left"
@@ -31,27 +38,31 @@ class Character:
         # appply a fixed conversion factor so that the sprite looks
         # right for the terrain tiles. This will change if the characters
         # are redrawn at a different resolution
+        zoom = quantise_zoom(zoom)
         new_magnification = zoom * 0.5
-        print("zoom=",zoom)
-        if (self._magnification != new_magnification
-            or self._zoomed_sprite == None):
+        console_msg("zoom=" + str(zoom), 8)
+        if self._sprite is None:
             self._magnification = new_magnification
-            if zoom < SMOOTH_ZOOM_THRESHOLD:
-                self._zoomed_sprite = pygame.transform.smoothscale(
-                    self._sprite,
-                    (
-                        int(self._sprite.get_width() * self._magnification),
-                        int(self._sprite.get_height() * self._magnification)
-                    )
-                )
-            else:
-                self._zoomed_sprite = pygame.transform.scale(
-                    self._sprite,
-                    (
-                        int(self._sprite.get_width() * self._magnification),
-                        int(self._sprite.get_height() * self._magnification)
-                    )
-            )
+        elif (self._magnification != new_magnification
+              or self._zoomed_sprite == None):
+            self._magnification = new_magnification
+            # sprites for recent zoom levels are cached, to avoid
+            # rescaling every time the mouse wheel moves
+            self._zoomed_sprite = self._sprite_cache.get(new_magnification)
+            if self._zoomed_sprite is None:
+                self._zoomed_sprite = self.scale_sprite(zoom)
+                self._sprite_cache.put(new_magnification, self._zoomed_sprite)
+
+    def scale_sprite(self, zoom):
+        size = (int(self._sprite.get_width() * self._magnification),
+                int(self._sprite.get_height() * self._magnification))
+        if zoom < SMOOTH_ZOOM_THRESHOLD:
+            scaled = pygame.transform.smoothscale(self._sprite, size)
+        else:
+            scaled = pygame.transform.scale(self._sprite, size)
+        # RLE makes colour-keyed sprites much quicker to blit
+        scaled.set_colorkey(self._sprite.get_colorkey(), pygame.RLEACCEL)
+        return scaled
 
     def get_sprite(self):
         if self._zoomed_sprite != None:
@@ -69,10 +80,14 @@ class Robot(Character):
         super().__init__(name, world, image_file, start_position, zoom)
         self.speaking = False
         self.speech_bubble = None
+        # changes whenever the speech bubble does, so the world
+        # knows when it needs redrawing
+        self.speech_version = 0
         self.python_interpreter = VirtualMachine(self)
         console_msg(name + " command interpreter initialised", 2)
         self.source_code = []
         self.output = []
+        self.on_program_finished = None  # callback for the running program
         self.x = 67
         # this dictionary contains all the special variables that
         # can be used in player programs, together with the variable
@@ -95,8 +110,11 @@ class Robot(Character):
     def set_source_code(self, text):
         pass
 
-    def run_program(self):
-        """ pass the text in the editor to the interpreter"""
+    def run_program(self, on_finish=None):
+        """ pass the text in the editor to the interpreter.
+        The program doesn't run straight away: it is advanced a little
+        on each call to update(). on_finish(result, errors) is called when
+        it completes, or immediately if it fails to compile"""
         # run_enabled is set false on each run
         # and cleared using the reset button
         if self.python_interpreter.run_enabled:
@@ -113,12 +131,43 @@ class Robot(Character):
                     msg = error_msg + " on line " + str(error_line)
                     console_msg(msg, 5)
             else:
-                result, errors = p.run()  # set the program going
-            return result, errors
-        return False, "RUN NOT ENABLED"
+                self.on_program_finished = on_finish
+                p.start()  # set the program going
+                return True, []
+        else:
+            result, errors = False, "RUN NOT ENABLED"
+        if on_finish:
+            on_finish(result, errors)
+        return result, errors
+
+    def update(self):
+        """ advance the running program, if there is one.
+        Called by the world once per game tick"""
+        p = self.python_interpreter  # for brevity
+        if p.waiting_for_input and not self.world.input.is_active():
+            result = self.world.input.convert_to_lines()[0]
+            console_msg("input:" + str(result), 8)
+            p.resume_input(result)
+        # the program waits while the world catches up with it,
+        # eg while the farmer is walking to a plot
+        if p.is_running() and not self.world.busy():
+            p.update()
+            if not p.is_running():
+                self.program_finished()
+
+    def program_finished(self):
+        # pass the outcome on to whoever started the program
+        if self.on_program_finished:
+            finished = self.on_program_finished
+            self.on_program_finished = None
+            finished(*self.python_interpreter.result)
 
     def halt_program(self):
-        pass
+        # stop the program straight away, eg if the stop button is pressed
+        p = self.python_interpreter  # for brevity
+        if p.is_running():
+            p.halt("the program was stopped")
+            self.program_finished()
 
     def validate_attempt(self):
         return True
@@ -131,24 +180,35 @@ class Robot(Character):
             speech = f.getvalue()
             self.output.append(speech)
 
+        if self.world.headless:
+            return  # nothing to draw, so carry straight on
         self.create_speech_bubble(speech,
                                  self.world.editor.get_fg_color(),
                                  self.world.editor.get_bg_color())
+        # make sure the bubble is drawn before the program continues
+        self.python_interpreter.request_update()
 
     def error(self, msg, type="Syntax error!"):
         # show the error in a speak-bubble above the character
+        if self.world.headless:
+            console_msg(self.name + ' ' + type + msg, 8)
+            return
         self.create_speech_bubble(type + msg,
                                   (0, 0, 0),
                                   (254, 0, 0))  # red, but not 255 because that's the alpha
 
     def input(self, msg=''):
         # get input from the user in a separate editor window
+        # the interpreter waits until update() sees that the window
+        # has been closed, and then passes it the result
+        if self.world.headless:
+            # there's nobody to ask, so use the world's prepared answers
+            # if it runs out, the program stops waiting for input
+            result = self.world.next_input()
+            if result is not None:
+                self.python_interpreter.resume_input(result)
+            return
         self.world.input.activate('input:' + msg)
-        while self.world.input.is_active():
-            self.world.update(self)
-        result = self.world.input.convert_to_lines()[0]
-        console_msg("input:" + str(result), 8)
-        return result
 
     def clear_all_output(self):
         # blanks the speech bubble, if present
@@ -156,11 +216,13 @@ class Robot(Character):
         if self.speech_bubble:
             self.speech_bubble.clear()
             self.speaking = False
+            self.speech_version += 1
         self.output=[]
 
     def clear_speech_bubble(self):
         self.speech_bubble = None
         self.speaking = False
+        self.speech_version += 1
 
     def create_speech_bubble(self, text, fg_col, bg_col):
         # show a speak-bubble above the character with the text in it
@@ -175,6 +237,7 @@ class Robot(Character):
         else:
             self.speech_bubble = SpeechBubble(text, fg_col, bg_col, self.world.code_font)
         self.speaking = True
+        self.speech_version += 1
 
     def get_speech_bubble(self):
         if self.facing == "right":
@@ -226,3 +289,8 @@ class Farmer(Robot):
         self.magic_variables['row1'] = self.furrows[0]
         #self.add_magic_variable('furrows', self.furrows)
 
+    def get_tending_position(self, coords: Point) -> Point:
+        # where to stand to work on the plot at coords
+        # the furrows run along the x axis, so this is the tile in front
+        return Point(coords.x, coords.y + 1)
+
@@ -19,6 +19,73 @@ WINDOW_SIZE = Point(1600,830)
 BLOCK_SIZE = 256
 SMOOTH_ZOOM_THRESHOLD = 0.4  # zooms smaller than this use smoothscaling
 
+# Zoom
+# zoom factors are snapped to whole powers of ZOOM_STEP, so that tiles,
+# sprites and landscape chunks rendered at each level can be reused
+ZOOM_STEP = 1.1
+MIN_ZOOM = 0.1
+MAX_ZOOM = 10
+TILE_CACHE_PIXELS = 8000000  # memory limit for tiles at all zoom levels
+SPRITE_CACHE_PIXELS = 4000000  # memory limit for each character's sprites
+
+# Landscape rendering
+CHUNK_SIZE = 16  # the landscape is cached in chunks of up to 16x16 tiles
+CHUNK_MAX_WIDTH = 2048  # fewer tiles per chunk at high zoom, to fit this
+LANDSCAPE_CACHE_PIXELS = 16000000  # memory limit for all cached chunks
+
+# Frame rate
+TARGET_FPS = 60  # the game never runs faster than this
+IDLE_FPS = 20  # how often to check for input when nothing is changing
+FRAME_HISTORY = 300  # number of recent frames used for timing stats
+FRAME_REPORT_INTERVAL = 600  # frames between timing reports (0 for never)
+
+# Interpreter scheduling
+# each game tick, the interpreter runs batches of this many bytecodes
+# (set to 1 to hand back to the game loop after every single bytecode)
+INSTRUCTIONS_PER_UPDATE = 200
+# the interpreter keeps running batches until it has used this many ms
+# of the tick (if None, only one batch is run per tick)
+UPDATE_TIME_SLICE = 8
+# replace common sequences of bytecodes with faster superinstructions
+OPTIMISE_BYTECODE = True
+# number of compiled programs to keep, so they can be run again instantly
+COMPILE_CACHE_SIZE = 256
+# limits for each run of a program, so that a runaway program is stopped
+# with an error instead of running forever (None for no limit)
+MAX_INSTRUCTIONS = 50000000  # bytecodes
+MAX_RUN_TIME = 120  # seconds spent running, not waiting for input etc
+MAX_CALL_DEPTH = 200  # functions calling functions
+MAX_LIST_SIZE = 1000000  # items in a list (or characters in a string)
+
+# Animation
+FARMER_SPEED = 4  # tiles per second
+ACTION_TIME = 0.25  # seconds to water a plot etc
+# the program can run this many actions ahead of the animation before
+# it waits for the farmer to catch up
+ANIMATION_PIPELINE = 4
+ANIMATION_MAX_QUEUE = 1000  # older actions are skipped beyond this
+ANIMATION_FAST_FORWARD = False  # skip all animation (toggle with F)
+
+# Farm simulation
+# plots are updated in fixed steps of game time, however fast the game
+# is running. All rates are per step
+SIMULATION_STEP = 0.5  # seconds
+MAX_SIMULATION_STEPS = 10  # per frame, so a long pause can't stall the game
+EVAPORATION = 0.02  # water lost
+GROWTH_RATE = 0.01  # growth of a well-watered plot (1 is fully grown)
+FERTILISER_BOOST = 1.0  # extra growth per unit of fertiliser
+FERTILISER_USE = 0.005  # fertiliser used up while growing
+BUG_SPREAD = 0.05  # bugs gained per unit of bugs on neighbouring plots
+BUG_DAMAGE = 0.5  # fraction of growth lost on a plot full of bugs
+
+# Batch grading
+# tighter limits for each program run by batch_grader.py
+GRADER_MAX_INSTRUCTIONS = 5000000
+GRADER_TIME_LIMIT = 10  # seconds
+# a program still going after this many seconds (eg stuck in one huge
+# calculation, which the interpreter can't interrupt) has its process killed
+GRADER_WALL_CLOCK_LIMIT = 30
+
 # Colour palette
 SKY_BLUE = (138, 198, 224)
 LIGHT_GREEN = (186, 212, 173)
@@ -28,6 +95,7 @@ STRAW = (226, 212, 147)
 GOLD = (224, 153, 63)
 TAN = (209, 188, 157)
 BROWN = (151, 56, 54)
+WET_SOIL = (104, 40, 43)  # watered plots
 BEAR_BROWN = (183, 142, 112)
 UI_BACKGROUND = BEAR_BROWN
 UI_FOREGROUND = STRAW
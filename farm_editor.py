@@ -88,12 +88,17 @@ class FarmCodeWindow(Editor):
 
     def run_program(self):
         self.robot.set_source_code(self.text)
-        success, errors = self.robot.run_program()
-        # if the code compiled ok, we check next that output matched expected
-        if success:
-            self.robot.validate_attempt()
-        # save this attempt, regardless of whether it had errors or not
-        self.session.save_run(farm_interpreter.convert_to_lines(self.text), errors)
+        # keep a copy of the source, in case it is edited while running
+        source_lines = farm_interpreter.convert_to_lines(self.text)
+
+        def program_finished(success, errors):
+            # if the code ran ok, we check next that output matched expected
+            if success:
+                self.robot.validate_attempt()
+            # save this attempt, regardless of whether it had errors or not
+            self.session.save_run(source_lines, errors)
+
+        self.robot.run_program(on_finish=program_finished)
 
     # def run_program(self):
     #     """ pass the text in the editor to the interpreter"""
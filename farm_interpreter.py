@@ -1,13 +1,30 @@
 import collections
 import dis  # built-in python disassembler - used for tokenising
+import hashlib
 import inspect
 import operator
 import sys
+import time
 import types
 
+from config import INSTRUCTIONS_PER_UPDATE, UPDATE_TIME_SLICE, \
+    COMPILE_CACHE_SIZE, OPTIMISE_BYTECODE
+from config import MAX_INSTRUCTIONS, MAX_RUN_TIME, MAX_CALL_DEPTH, \
+    MAX_LIST_SIZE
 from console_messages import console_msg
 from constants import CONSOLE_VERBOSE
 
+# types whose size is limited by max_list_size, including subclasses
+# such as Furrow
+GROWABLE_TYPES = (list, str, tuple, bytes)
+
+# the most frames kept for reuse, for each function
+FRAME_POOL_SIZE = 16
+
+# marks a local variable that hasn't been assigned yet, or a global that
+# hasn't been looked up yet (None can't be used, since it's a valid value)
+UNBOUND = object()
+
 
 def convert_to_lines(text):
     """ convert the raw editor characters into lines of source code
@@ -32,6 +49,17 @@ def convert_to_lines(text):
     return source
 
 
+def normalise_source(lines):
+    """ joins lines of source code into a single string for compiling.
+    Trailing spaces and blank lines at the end don't change what a
+    program does, so they are removed, which means that the same program
+    always gives the same string (see CompileCache) """
+    lines = [line.rstrip() for line in lines]
+    while lines and not lines[-1]:
+        lines.pop()
+    return chr(13).join(lines)
+
+
 def is_a_number(p):
     # check for numeric parameters
     try:
@@ -43,6 +71,12 @@ def is_a_number(p):
 
 class Frame(object):
     # data structure to represent the call frames
+    # frames for function calls are recycled (see get_call_frame), so
+    # __slots__ is used to keep them small and quick to access
+    __slots__ = ['code_obj', 'global_names', 'local_names', 'prev_frame',
+                 'stack', 'builtin_names', 'last_instruction', 'block_stack',
+                 'instructions', 'fast_locals', 'global_cache']
+
     def __init__(self, code_obj, global_names, local_names, prev_frame):
         self.code_obj = code_obj
         self.global_names = global_names
@@ -58,6 +92,15 @@ class Frame(object):
 
         self.last_instruction = 0
         self.block_stack = []
+        # the pre-decoded (handler, argument) pairs for code_obj
+        self.instructions = None
+        # the values of local variables in functions, in the same order
+        # as code_obj.co_varnames, so LOAD_FAST and STORE_FAST can use
+        # the index instead of looking up the name
+        self.fast_locals = [UNBOUND] * code_obj.co_nlocals
+        # globals and builtins that the code has already looked up,
+        # in the same order as code_obj.co_names. See byte_LOAD_GLOBAL
+        self.global_cache = None
 
 
 class Function(object):
@@ -74,36 +117,73 @@ class Function(object):
     ]
 '''
 
-    def __init__(self, name, code, globs, defaults, closure, vm):
+    def __init__(self, name, code, globs, defaults, closure, vm,
+                 kwdefaults=None):
         """ opaque stuff copied directly from Allison Kaptur"""
         self._vm = vm
         self.func_code = code
         self.func_name = self.__name__ = name or code.co_name
         self.func_defaults = tuple(defaults)
+        self.func_kwdefaults = kwdefaults
         self.func_globals = globs
-        self.func_locals = self._vm.frame.local_names
         # crashes if uncommented
         # may be due to new function call types since 3.7
         # self.__dict__ = {}
         self.func_closure = closure
         self.__doc__ = code.co_consts[0] if code.co_consts else None
-
+        # only made if it's needed, see get_python_function()
+        self._func = None
+
+        # work out how arguments are passed now, rather than on every call
+        # plain positional parameters, which is all that most student
+        # functions use, are copied straight into the new frame
+        self.arg_count = code.co_argcount
+        self.min_args = self.arg_count - len(self.func_defaults)
+        self.simple_args = (code.co_kwonlyargcount == 0
+                            and not code.co_flags & (inspect.CO_VARARGS
+                                                     | inspect.CO_VARKEYWORDS))
+
+    def get_python_function(self):
         # sometimes we need a 'real' Python function. This is for that
-        kw = {
-            'argdefs': self.func_defaults,
-        }
-        if closure:
-            kw['closure'] = tuple(make_cell(0) for _ in closure)
-        self._func = types.FunctionType(code, globs, **kw)
-
-    def __call__(self, *args, **kwargs):
-        """ constructs and runs the call frame """
-        callargs = inspect.getcallargs(self._func, *args, **kwargs)
+        if self._func is None:
+            kw = {
+                'argdefs': self.func_defaults,
+            }
+            if self.func_closure:
+                kw['closure'] = tuple(make_cell(0)
+                                      for _ in self.func_closure)
+            self._func = types.FunctionType(self.func_code,
+                                            self.func_globals, **kw)
+            self._func.__kwdefaults__ = self.func_kwdefaults
+        return self._func
+
+    def make_call_frame(self, *args, **kwargs):
+        """ constructs the call frame """
+        arg_count = len(args)
+        if (self.simple_args and not kwargs
+                and self.min_args <= arg_count <= self.arg_count):
+            frame = self._vm.get_call_frame(self.func_code,
+                                            self.func_globals)
+            fast_locals = frame.fast_locals
+            fast_locals[:arg_count] = args
+            if arg_count < self.arg_count:
+                # fill in the missing arguments from the defaults
+                fast_locals[arg_count:self.arg_count] = \
+                    self.func_defaults[arg_count - self.min_args:]
+            return frame
+        # anything more complicated is left to python, which also gives
+        # the right error message if the arguments don't fit
+        callargs = inspect.getcallargs(self.get_python_function(),
+                                       *args, **kwargs)
         # callargs provides a mapping of arguments to pass into the frame
-        frame = self._vm.make_frame(
+        return self._vm.make_frame(
             self.func_code, callargs, self.func_globals, {}
         )
-        return self._vm.run_frame(frame)
+
+    def __call__(self, *args, **kwargs):
+        """ constructs and runs the call frame.
+        Only used when python code calls a student function """
+        return self._vm.run_frame(self.make_call_frame(*args, **kwargs))
 
 
 def make_cell(value):
@@ -119,6 +199,72 @@ def make_cell(value):
 Block = collections.namedtuple('Block', ['type', 'handler', 'stack_height'])
 
 
+class DecodedCode(object):
+    """ the instructions of a code object, resolved once into
+    (handler, argument) pairs. The list is indexed by bytecode offset // 2,
+    since every instruction is exactly 2 bytes, so jump targets can be used
+    to index it directly."""
+    def __init__(self, code_obj):
+        self.code_obj = code_obj
+        self.instructions = []
+        self.line_numbers = []  # source line for each instruction
+        self.unrecognised = []  # names of any bytecodes we can't run
+
+
+class CompiledProgram(object):
+    """ the result of compiling a program: either the code object and the
+    decoded instructions for it (and every function inside it), or the
+    reason it couldn't be compiled.
+    Once made, this is never changed, so it can be shared between any
+    number of virtual machines."""
+    def __init__(self, success, msg, code_object=None, decoded_code=None,
+                 compile_time_error=None):
+        self.success = success
+        self.msg = msg
+        self.code_object = code_object
+        self.decoded_code = decoded_code  # code object: DecodedCode
+        self.compile_time_error = compile_time_error
+
+
+class CompileCache(object):
+    """ remembers the most recently compiled programs, keyed by a hash of
+    their source, so that running the same program again doesn't need
+    to compile and decode it again. When the cache is full, the program
+    that was used longest ago is thrown away."""
+    def __init__(self, size):
+        self.size = size
+        self._programs = collections.OrderedDict()  # oldest first
+
+    def __len__(self):
+        return len(self._programs)
+
+    @staticmethod
+    def get_key(source, optimise):
+        # optimised and unoptimised versions are kept separately
+        return hashlib.sha256(source.encode('utf-8')).hexdigest(), optimise
+
+    def get(self, key):
+        # returns the CompiledProgram, or None if it isn't in the cache
+        program = self._programs.get(key)
+        if program is not None:
+            self._programs.move_to_end(key)  # most recently used
+        return program
+
+    def put(self, key, program):
+        self._programs[key] = program
+        self._programs.move_to_end(key)
+        while len(self._programs) > self.size:
+            self._programs.popitem(last=False)
+
+    def clear(self):
+        self._programs.clear()
+
+
+# shared by every robot, so a program that any of them has run before
+# starts straight away
+compiled_programs = CompileCache(COMPILE_CACHE_SIZE)
+
+
 class VirtualMachineError(Exception):
     pass
 
@@ -136,6 +282,33 @@ class VirtualMachine:
         self.compile_time_error = None
         self.run_time_error = None
         self.byte_code = None
+        # DecodedCode for each code object, so each is only decoded once
+        self.decoded_code = {}
+        self.instruction_count = 0  # total bytecodes executed
+        # the game loop runs instructions in batches of this size,
+        # checking the clock in between. See update()
+        self.instructions_per_update = INSTRUCTIONS_PER_UPDATE
+        # replace common sequences of instructions with superinstructions
+        # see fuse_instructions()
+        self.optimise = OPTIMISE_BYTECODE
+        # limits for each run, see config.py
+        # None means no limit
+        self.max_instructions = MAX_INSTRUCTIONS
+        self.max_run_time = MAX_RUN_TIME
+        self.max_call_depth = MAX_CALL_DEPTH
+        self.max_list_size = MAX_LIST_SIZE
+        self.instructions_left = 0  # before the instruction limit is hit
+        self.run_time = 0  # seconds spent running so far
+        self.step_started = 0  # when the current step began, see step()
+        # the results of global lookups, for each code object
+        # see byte_LOAD_GLOBAL
+        self.global_caches = {}  # code object: list of cached values
+        self.cached_globals = {}  # name: list of (cache, index) using it
+        # finished function frames, ready to be reused for the next call
+        self.frame_pools = {}  # code object: list of frames
+        self.update_requested = False  # yield to the game loop asap
+        self.waiting_for_input = False  # suspended inside input()
+        self.result = None  # outcome of the last program run
         self.stack = []
         self.running = False  # true when a program is executing
         # functions that replace the standard python functions
@@ -151,8 +324,12 @@ class VirtualMachine:
     def is_running(self):
         return self.running
 
-    def halt(self):
-        """halts execution immediately"""
+    def halt(self, reason=None):
+        """halts execution immediately.
+        If a reason is given, it is reported as a run-time error"""
+        if reason is not None:
+            self.run_time_error = reason
+        self.finish('quit')
         self.running = False
 
     def sync_magic_variables(self, frame):
@@ -210,52 +387,233 @@ class VirtualMachine:
                             frame.global_names[v] = current_value
                             done = True
 
-    def run(self, global_names=None, local_names=None):
-        """ creates an entry point for code execution on the vm"""
+    def request_update(self):
+        """ makes the interpreter hand control back to the game loop
+        after the current instruction. Used for visible side effects,
+        like speech or changes to the furrows, which should appear on
+        screen straight away """
+        self.update_requested = True
+
+    def start(self, global_names=None, local_names=None):
+        """ creates an entry point for code execution on the vm.
+        Nothing is executed until update() or run() is called"""
         # the run_enabled flag is not currently cleared on run,
         # so the puzzle doesn't need to be reset before
         # running again.
+        self.running = False
         if self.run_enabled:
             #self.run_enabled = False
             if self.byte_code:
                 console_msg('Executing...', 5)
-                self.running = True
-                frame = self.make_frame(self.byte_code, global_names=global_names,
+                self.frames = []
+                self.frame = None
+                self.stack = []
+                self.return_value = None
+                self.last_exception = None
+                self.run_time_error = None
+                self.result = None
+                self.waiting_for_input = False
+                self.update_requested = False
+                self.instructions_left = self.max_instructions
+                if self.instructions_left is None:
+                    self.instructions_left = float('inf')
+                self.run_time = 0
+                self.global_caches = {}
+                self.cached_globals = {}
+                self.frame_pools = {}
+                frame = self.make_frame(self.byte_code,
+                                        global_names=global_names,
                                         local_names=local_names)
-                result = self.run_frame(frame)
-                if result in ('exception', 'quit'):
-                    self.running = False
-                    console_msg("COMPILE ERRORS="
-                                + str(self.compile_time_error), 4)
-                    console_msg("RUN ERRORS=" + str(self.run_time_error), 4)
-                    errors = []
-                    if self.compile_time_error:
-                        msg = str(self.compile_time_error)
-                        errors.append(msg)
-                        self.robot.error(msg, type="Syntax error:")
-                    if self.run_time_error:
-                        msg = str(self.run_time_error)
-                        errors.append(msg)
-                        self.robot.error(msg, type="Run-time error:")
-                    if self.last_exception:
-                        msg = str(self.last_exception[1])
-                        errors.append(msg)
-                        self.robot.error(msg, type="Run-time error:")
-                    return False, errors
+                self.push_frame(frame)
+                self.running = True
+        return self.running
+
+    def update(self, time_slice=UPDATE_TIME_SLICE):
+        """ continue executing the current program.
+        This is called by the game loop once per tick, and runs
+        batches of instructions until time_slice ms have passed, or
+        until the program does something that needs to be shown on
+        screen. If time_slice is None, just one batch is run.
+        Returns True if the program is still running"""
+        if time_slice is not None:
+            deadline = time.perf_counter() + time_slice / 1000
+        while self.running and not self.waiting_for_input:
+            self.step(self.instructions_per_update)
+            if self.update_requested:
+                self.update_requested = False
+                break
+            if time_slice is None or time.perf_counter() >= deadline:
+                break
+        return self.running
+
+    def run(self, global_names=None, local_names=None):
+        """ runs the whole program without handing control back to the
+        game loop, and returns the result (see finish)"""
+        if self.start(global_names, local_names):
+            while self.running:
+                if self.waiting_for_input:
+                    # nothing can supply the input
+                    self.halt("input() isn't available here")
+                    break
+                self.step(self.instructions_per_update)
+                self.update_requested = False
+            return self.result
+
+    def step(self, count, base_depth=0):
+        """ execute up to count instructions.
+        Calls to student functions push a new frame, rather than
+        recursing, so execution can be suspended and resumed at any
+        point. Stops early when a frame at base_depth returns, or when
+        the program needs to yield to the game loop.
+        The run's limits are checked at the end of each step, rather than
+        after every instruction, so steps should be kept fairly short"""
+        frame = self.frame
+        instructions = frame.instructions
+        executed = 0
+        # never go past the instruction limit
+        if count > self.instructions_left:
+            count = self.instructions_left
+        if base_depth == 0:
+            self.step_started = time.perf_counter()
+        while executed < count and self.running:
+            executed += 1
+            # the python equivalent of CPython's 1500-line switch statement.
+            # Each instruction was resolved to its method when the code
+            # was decoded, so all we need to do here is index and call.
+            # this state variable keeps track of what the interpreter was
+            # doing when the operation completes - this is important to
+            # maintain the integrity of the data and block stacks.
+            # the possible values are None, call, yield, continue, break,
+            # return, exception and quit
+            handler, argument = instructions[frame.last_instruction >> 1]
+            # move to next instruction
+            # all byte codes are exactly 2 bytes, since Python 3.6
+            frame.last_instruction += 2
+            try:
+                stack_unwind_reason = handler(self, *argument)
+            except:
+                # handles run-time errors while executing the code
+                self.last_exception = sys.exc_info()[:2] + (None,)
+                stack_unwind_reason = 'exception'
+            if not stack_unwind_reason:
+                continue
+
+            if stack_unwind_reason == 'yield':
+                # let the world catch up with what the program has done
+                break
+            if stack_unwind_reason == 'call':
+                # a new frame has been pushed for a student function
+                frame = self.frame
+                instructions = frame.instructions
+                continue
+
+            # block management
+            while stack_unwind_reason and frame.block_stack:
+                stack_unwind_reason = \
+                    self.manage_block_stack(stack_unwind_reason)
+
+            if stack_unwind_reason == 'return':
+                if len(self.frames) > base_depth + 1:
+                    # carry on running the calling frame
+                    self.pop_frame()
+                    self.push(self.return_value)
+                    frame = self.frame
+                    instructions = frame.instructions
+                    continue
+                if base_depth == 0:
+                    self.finish(stack_unwind_reason)
                 else:
-                    self.running = False
-                    return True, result  # no errors
-            else:
-                self.running = False  # no bytecode to execute
+                    self.pop_frame()  # back to run_frame
+                break
+            elif stack_unwind_reason:
+                # errors end the whole program, not just this frame
+                self.finish(stack_unwind_reason)
+                break
+        self.instruction_count += executed
+        self.instructions_left -= executed
+        run_time = self.run_time + time.perf_counter() - self.step_started
+        if base_depth == 0:
+            # the time is only added up here, since any steps for
+            # run_frame() happen inside this one, and are included
+            self.run_time = run_time
+        if self.running:
+            self.check_limits(run_time)
+
+    def check_limits(self, run_time):
+        # stops the program if it has used up its instructions or time
+        if self.instructions_left <= 0:
+            self.halt("the program was stopped after running "
+                      + str(self.max_instructions) + " instructions."
+                      " Is there a loop that never ends?")
+        elif (self.max_run_time is not None
+              and run_time > self.max_run_time):
+            self.halt("the program was stopped after running for "
+                      + str(self.max_run_time) + " seconds."
+                      " Is there a loop that never ends?")
+
+    def check_size(self, size):
+        # raises an error if a list (or string etc) is too big
+        if self.max_list_size is not None and size > self.max_list_size:
+            raise MemoryError("that would make a list with more than "
+                              + str(self.max_list_size) + " items")
+
+    def finish(self, stack_unwind_reason):
+        """ stops the program and reports any errors.
+        The outcome is stored in self.result, as a (success, errors)
+        tuple for failed programs, or (True, return value) """
+        if self.frame is None:
+            return  # already finished
+        line = self.get_line_number()
+        self.running = False
+        self.frames = []
+        self.frame = None
+        if stack_unwind_reason in ('exception', 'quit'):
+            # 'quit' allows us to quit gracefully
+            # with a console error that doesn't crash the game
+            # It should only be used for errors that just affect the
+            # in-game program
+            console_msg("COMPILE ERRORS="
+                        + str(self.compile_time_error), 4)
+            console_msg("RUN ERRORS=" + str(self.run_time_error), 4)
+            errors = []
+            if self.compile_time_error:
+                msg = str(self.compile_time_error)
+                errors.append(msg)
+                self.robot.error(msg, type="Syntax error:")
+            # errors from running the code say which line they came from
+            # but not if the program was stopped from outside
+            where = ''
+            if stack_unwind_reason == 'exception' and line is not None:
+                where = 'line ' + str(line) + ': '
+            if self.run_time_error:
+                msg = where + str(self.run_time_error)
+                errors.append(msg)
+                self.robot.error(msg, type="Run-time error:")
+            if self.last_exception:
+                msg = where + str(self.last_exception[1])
+                errors.append(msg)
+                self.robot.error(msg, type="Run-time error:")
+            self.result = (False, errors)
         else:
-            self.running = False  # execution is disabled
+            self.result = (True, self.return_value)  # no errors
+
+    def get_line_number(self):
+        # the source line of the instruction that ran most recently
+        # (last_instruction has already moved on to the next one)
+        # or None if nothing has run yet
+        frame = self.frame
+        decoded = self.decoded_code.get(frame.code_obj)
+        index = (frame.last_instruction >> 1) - 1
+        if decoded is None or index < 0:
+            return None
+        return decoded.line_numbers[index]
 
     def make_frame(self, code, callargs=None,
                    global_names=None, local_names=None):
         if callargs is None:
             callargs = {}
         if global_names is not None and local_names is not None:
-            local_names = global_names
+            pass  # eg a function call, with its own (empty) local names
         elif self.frames:
             global_names = self.frame.global_names
             local_names = {}
@@ -268,16 +626,66 @@ class VirtualMachine:
             }
             global_names.update(self.robot.magic_variables)
             local_names = global_names
-        local_names.update(callargs)
         frame = Frame(code, global_names, local_names, self.frame)
+        frame.instructions = self.decode(code).instructions
+        # arguments are the first local variables
+        if callargs:
+            fast_locals = frame.fast_locals
+            for index, name in enumerate(code.co_varnames):
+                if name.startswith('.'):
+                    # inspect renames implicit arguments, like the
+                    # iterator passed to a list comprehension
+                    name = 'implicit' + name[1:]
+                if name in callargs:
+                    fast_locals[index] = callargs[name]
+        global_cache = self.global_caches.get(code)
+        if global_cache is None:
+            global_cache = [UNBOUND] * len(code.co_names)
+            self.global_caches[code] = global_cache
+        frame.global_cache = global_cache
         return frame
 
+    def get_call_frame(self, code, global_names):
+        """ returns an empty frame for calling a function, reusing
+        one from an earlier call if possible"""
+        pool = self.frame_pools.get(code)
+        if pool:
+            frame = pool.pop()
+            frame.global_names = global_names
+            frame.prev_frame = self.frame
+            return frame
+        return self.make_frame(code, None, global_names, {})
+
+    def release_frame(self, frame):
+        # keep a finished function frame, so it can be reused by
+        # get_call_frame. Its contents are cleared, so that it doesn't
+        # keep any of the program's objects alive
+        pool = self.frame_pools.setdefault(frame.code_obj, [])
+        if len(pool) < FRAME_POOL_SIZE:
+            frame.fast_locals = [UNBOUND] * len(frame.fast_locals)
+            if frame.local_names:
+                frame.local_names.clear()
+            frame.prev_frame = None
+            frame.last_instruction = 0
+            del frame.block_stack[:]
+            del frame.stack[:]
+            pool.append(frame)
+
     def push_frame(self, frame):
+        if (self.max_call_depth is not None
+                and len(self.frames) > self.max_call_depth):
+            raise RecursionError("too many functions calling each other"
+                                 " (more than " + str(self.max_call_depth)
+                                 + " deep). Does a function call itself"
+                                   " forever?")
         self.frames.append(frame)
         self.frame = frame
 
     def pop_frame(self):
-        self.frames.pop()
+        frame = self.frames.pop()
+        if frame.local_names is not frame.global_names:
+            # a function call, rather than the main program
+            self.release_frame(frame)
         if self.frames:
             self.frame = self.frames[-1]
         else:
@@ -362,126 +770,186 @@ class VirtualMachine:
             return stack_unwind_reason
         return stack_unwind_reason
 
-    def parse_byte_and_args(self):
-        """ parse the bytecode instruction
-        if the instruction has no arguments, it is a single byte long
-        instructions with arguments are 3 bytes long - argument = 2 bytes """
-        f = self.frame  # for brevity
-        op_offset = f.last_instruction
-        byte_code = f.code_obj.co_code[op_offset]
-        byte_name = dis.opname[byte_code]
-
-        # this uses the lists included in the dis module to check the meaning
-        # of the arguments for each instruction. There are only a few
-        # different possibilities and this approach is much more concise
-        # than exhaustively testing for each individual instruction
+    def decode(self, code_obj):
+        """ returns the DecodedCode for a code object, decoding it
+        (and any functions defined inside it) the first time it is seen"""
+        decoded = self.decoded_code.get(code_obj)
+        if decoded is None:
+            decoded = DecodedCode(code_obj)
+            line = code_obj.co_firstlineno
+            jump_targets = set()  # list indexes that are jumped to
+            for instruction in dis.get_instructions(code_obj):
+                if instruction.starts_line is not None:
+                    line = instruction.starts_line
+                if instruction.is_jump_target:
+                    jump_targets.add(instruction.offset >> 1)
+                handler, argument = self.decode_instruction(instruction)
+                if handler is VirtualMachine.unrecognised_bytecode:
+                    decoded.unrecognised.append(instruction.opname)
+                # get_instructions yields one entry per 2-byte instruction
+                # (including EXTENDED_ARG) so the list index is offset // 2
+                decoded.instructions.append((handler, argument))
+                decoded.line_numbers.append(line)
+            if self.optimise:
+                self.fuse_instructions(decoded.instructions, jump_targets)
+            self.decoded_code[code_obj] = decoded
+            # decode nested code objects (eg function bodies) up front,
+            # so that compile() can check them for unsupported bytecodes
+            for const in code_obj.co_consts:
+                if isinstance(const, types.CodeType):
+                    decoded.unrecognised.extend(
+                        self.decode(const).unrecognised)
+        return decoded
+
+    def fuse_instructions(self, instructions, jump_targets):
+        """ peephole optimisation: looks for common sequences of
+        instructions, and replaces the first one with a superinstruction
+        that does the work of the whole sequence, which saves dispatching
+        each one separately.
+        The rest of the sequence is left as it was, and skipped over by
+        the superinstruction, so line numbers don't change. It also
+        means that if a superinstruction meets something it doesn't
+        handle (eg an undefined variable) it can just do the first
+        instruction and let the others run as normal.
+        Nothing can jump into the middle of a sequence, or the jump would
+        land on an instruction that should have been skipped"""
+        for index in range(len(instructions)):
+            length, fused = self.find_superinstruction(instructions, index)
+            if fused and not jump_targets.intersection(
+                    range(index + 1, index + length)):
+                instructions[index] = fused
+
+    def find_superinstruction(self, instructions, index):
+        """ returns (length, (handler, argument)) for a superinstruction
+        that can replace the instructions starting at index,
+        or (0, None) if there isn't one """
+        VM = VirtualMachine  # for brevity
+        handlers = [h for h, argument in instructions[index:index + 4]]
+        args = [argument for h, argument in instructions[index:index + 4]]
+        handlers += [None] * (4 - len(handlers))
+
+        # for x in ... (x is stored straight away)
+        if handlers[0] is VM.byte_FOR_ITER:
+            if handlers[1] is VM.byte_STORE_NAME:
+                return 2, (VM.for_iter_store_name, args[0] + args[1])
+            if handlers[1] is VM.byte_STORE_FAST:
+                return 2, (VM.for_iter_store_fast, args[0] + args[1])
+
+        # x = a [op] b, including x += b
+        if handlers[2] in (VM.binaryOperator, VM.inplaceOperator,
+                           VM.addOperator):
+            op = args[2][0]
+            check_size = handlers[2] is VM.addOperator
+            if (handlers[0] is VM.byte_LOAD_NAME
+                    and handlers[3] is VM.byte_STORE_NAME):
+                if handlers[1] is VM.byte_LOAD_CONST:
+                    return 4, (VM.name_const_operator_store,
+                               args[0] + args[1] + (op, check_size)
+                               + args[3])
+                if handlers[1] is VM.byte_LOAD_NAME:
+                    return 4, (VM.name_name_operator_store,
+                               args[0] + args[1] + (op, check_size)
+                               + args[3])
+            if (handlers[0] is VM.byte_LOAD_FAST
+                    and handlers[3] is VM.byte_STORE_FAST):
+                if handlers[1] is VM.byte_LOAD_CONST:
+                    return 4, (VM.fast_const_operator_store,
+                               args[0] + args[1] + (op, check_size)
+                               + args[3])
+                if handlers[1] is VM.byte_LOAD_FAST:
+                    return 4, (VM.fast_fast_operator_store,
+                               args[0] + args[1] + (op, check_size)
+                               + args[3])
+
+        # a[i]
+        if (handlers[0] is VM.byte_LOAD_NAME
+                and handlers[1] is VM.byte_LOAD_NAME
+                and handlers[2] is VM.binaryOperator
+                and args[2][0] is operator.getitem):
+            return 3, (VM.name_name_subscript, args[0] + args[1])
+
+        # while a < 10:
+        if (handlers[0] is VM.byte_LOAD_NAME
+                and handlers[1] is VM.byte_LOAD_CONST
+                and handlers[2] is VM.byte_COMPARE_OP
+                and handlers[3] is VM.byte_POP_JUMP_IF_FALSE):
+            return 4, (VM.name_const_compare_jump,
+                       args[0] + args[1]
+                       + (self.COMPARE_OPERATORS[args[2][0]],) + args[3])
+        return 0, None
+
+    def decode_instruction(self, instruction):
+        """ find the method that implements an instruction
+        and resolve its argument.
+        The dis module has already done most of the work of looking up
+        constants, names and jump targets. """
+        byte_code = instruction.opcode
+        byte_name = instruction.opname
         if byte_code >= dis.HAVE_ARGUMENT:
-            # index into the byte code
-            # +1, so we access the argument, not the op_code
-            arg_val = f.code_obj.co_code[f.last_instruction + 1]
-            if byte_code in dis.hasconst:  # look up a constant
-                arg = f.code_obj.co_consts[arg_val]
-            elif byte_code in dis.hasname:  # look up a name
-                arg = f.code_obj.co_names[arg_val]
-            elif byte_code in dis.haslocal:  # look up a local name
-                arg = f.code_obj.co_varnames[arg_val]
-            elif byte_code in dis.hasjrel:  # calculate relative jump
-                # +2 so the jump does not include the current instruction
-                arg = f.last_instruction + arg_val + 2
+            if byte_name == 'LOAD_GLOBAL':
+                # the index in co_names is where the value is cached
+                argument = (instruction.arg, instruction.argval)
+            elif (byte_code in dis.hasconst
+                    or byte_code in dis.hasname
+                    or byte_code in dis.hasjrel):
+                # argval is the constant, the name, or the jump target
+                # (offset of the next instruction + the relative jump)
+                argument = (instruction.argval,)
+            elif byte_code in dis.haslocal:
+                # local variables are looked up by their index in
+                # fast_locals, but the name is needed for error messages
+                argument = (instruction.arg, instruction.argval)
             else:
-                arg = arg_val
-            argument = [arg]
+                # includes EXTENDED_ARG, so large args are already combined
+                argument = (instruction.arg,)
         else:
-            argument = []
-
-        # move to next instruction
-        # all byte codes are exactly 2 bytes, since Python 3.6
-        f.last_instruction += 2
-        return byte_name, argument
-
-    def dispatch(self, byte_name, argument):
-        """ the python equivalent of CPython's 1500-line switch statement
-        each byte name is assigned to its corresponding method.
-        Exceptions are caught and set on the VM"""
-
-        # this state variable keeps track of what the interpreter was doing
-        # when the operation completes - this is important to maintain the
-        # integrity of the data and block stacks.
-        # the possible values are None, continue, break, return and exception
-        stack_unwind_reason = None  # the normal case
-        try:
-            bytecode_fn = getattr(self, 'byte_%s' % byte_name, None)
-            if bytecode_fn is None:
-                if byte_name.startswith('UNARY_'):
-                    self.unaryOperator(byte_name[6:])
-                elif byte_name.startswith('BINARY_'):
-                    self.binaryOperator(byte_name[7:])
-                elif byte_name.startswith('INPLACE_'):
-                    self.inplaceOperator(byte_name[8:])
-                else:
-                    # raise VirtualMachineError(
-                    #    "unsupported bytecode type: %s" % byte_name
-                    # )
-                    console_msg("BZZT! Cannot recognise the bytecode" + byte_name, 0)
-                    stack_unwind_reason = 'quit'
+            argument = ()
+
+        handler = getattr(VirtualMachine, 'byte_%s' % byte_name, None)
+        if handler is None:
+            if (byte_name.startswith('UNARY_')
+                    and byte_name[6:] in self.UNARY_OPERATORS):
+                handler = VirtualMachine.unaryOperator
+                argument = (self.UNARY_OPERATORS[byte_name[6:]],)
+            elif (byte_name.startswith('BINARY_')
+                    and byte_name[7:] in self.BINARY_OPERATORS):
+                handler = self.SIZED_OPERATORS.get(
+                    byte_name[7:], VirtualMachine.binaryOperator)
+                argument = (self.BINARY_OPERATORS[byte_name[7:]],)
+            elif (byte_name.startswith('INPLACE_')
+                    and byte_name[8:] in self.INPLACE_OPERATORS):
+                handler = self.SIZED_OPERATORS.get(
+                    byte_name[8:], VirtualMachine.inplaceOperator)
+                argument = (self.INPLACE_OPERATORS[byte_name[8:]],)
             else:
-                stack_unwind_reason = bytecode_fn(*argument)
-        except:
-            # handles run-time errors while executing the code
-            self.last_exception = sys.exc_info()[:2] + (None,)
-            stack_unwind_reason = 'exception'
+                handler = VirtualMachine.unrecognised_bytecode
+                argument = (byte_name,)
+        return handler, argument
 
-        return stack_unwind_reason
+    def unrecognised_bytecode(self, byte_name):
+        # raise VirtualMachineError(
+        #    "unsupported bytecode type: %s" % byte_name
+        # )
+        console_msg("BZZT! Cannot recognise the bytecode" + byte_name, 0)
+        return 'quit'
 
     def run_frame(self, frame):
-        """ frames run until they return a value or raise an exception"""
+        """ runs a frame until it returns a value.
+        This is only needed when a student function is called from
+        python code (eg as the key for sorted), so it can't be suspended.
+        Calls made by the student program itself don't come through here,
+        see byte_CALL_FUNCTION"""
+        base_depth = len(self.frames)
         self.push_frame(frame)
-        while self.running:
-            # let the game world update to reflect keyboard input and physics
-            # we guarantee to update once per bytecode,
-            # but if the world is busy (eg moving blocks, keep calling
-            # update until it isn't
-            self.world.update()
-            while self.world.busy():
-                self.world.update()
-            # makes sure game variables in the program affect the world
-            # TODO this is currently disabled. Should I use a different system?
-            # it's possible that we don't actually need to manually sync
-            # since there isn't a separate player that can move independently
-            # from Farmer Bob
-            #self.sync_magic_variables(frame)
-
-            byte_name, arguments = self.parse_byte_and_args()
-            stack_unwind_reason = self.dispatch(byte_name, arguments)
-
-            # block management
-            while stack_unwind_reason and frame.block_stack:
-                stack_unwind_reason = \
-                    self.manage_block_stack(stack_unwind_reason)
-
-            if stack_unwind_reason:
-                break
-
-        self.pop_frame()
-
-        if stack_unwind_reason == 'exception':
-            # exc, val, tb = self.last_exception
-            # e = exc(val)
-            # e.__traceback__ = tb
-            # raise e  # TODO replace this with in-game error message
-            return 'exception'
-        elif stack_unwind_reason == 'quit':
-            # this option allows us to quit gracefully
-            # with a console error that doesn't crash the game
-            # It should only be used for errors that just affect the
-            # in-game program
-            return 'quit'  # propagate the return value up the call stack
-
+        while self.running and len(self.frames) > base_depth:
+            if self.waiting_for_input:
+                raise VirtualMachineError(
+                    "input() can't be used inside " + frame.code_obj.co_name)
+            self.step(self.instructions_per_update, base_depth)
+        if not self.running:
+            raise VirtualMachineError("the program has stopped")
         return self.return_value
 
-    def update(self):
-        """ continue executing the current program"""
-
     def jump(self, target):
         """Set bytecode pointer to "target", so this instruction is next"""
         self.frame.last_instruction = target
@@ -491,19 +959,35 @@ class VirtualMachine:
         return chr(13).join(self.source)
 
     def compile(self):
+        """ get the program ready to run, and report any errors.
+        Programs that have been compiled before are fetched from the
+        cache, rather than compiled again.
+        Returns (success, message)"""
+        source = normalise_source(self.source)
+        if not source:  # bail immediately if source is empty
+            return False, ''
+        key = compiled_programs.get_key(source, self.optimise)
+        program = compiled_programs.get(key)
+        if program is None:
+            program = self.compile_program(source)
+            compiled_programs.put(key, program)
+        else:
+            console_msg("Using previously compiled program", 6)
+
+        self.compile_time_error = program.compile_time_error
+        if program.success:
+            self.byte_code = program.code_object
+            self.decoded_code = program.decoded_code
+        else:
+            self.robot.error(program.msg, type="Compiler error:")
+        return program.success, program.msg
+
+    def compile_program(self, source) -> CompiledProgram:
         # build bytecode from the source using compile
         # and display the dissassembled instructions using dis
-
         console_msg("Lexing...", 6)
-        success = True
-        token_list = []
-        unrecognised = []
-        source = self.get_code()
-        if not source:  # bail immediately if source is empty
-            return False, ''
         try:
             code_object = compile(source, '', 'exec')
-            token_list = dis.get_instructions(code_object)
         except Exception as e:
             # handle lexing errors
             console_msg("Compiler error!", 3)
@@ -511,62 +995,33 @@ class VirtualMachine:
             error_details = e.args[1]
             error_line = error_details[1]
             # TODO display error message in-game (highlight in the editor?)
-            self.compile_time_error = {'error': error_type,
-                                       'line': error_line
-                                       }
-            success = False
             # see https://docs.python.org/3/library/traceback.html
             # for a possible way to have better error handling
             # also https://stackoverflow.com/questions/18176602/printhow-to-get-name-of-exception-that-was-caught-in-python
-
-        if success:
-            for instruction in token_list:
-                # list bytecode
-                console_msg("\t" + instruction.opname
-                            + str(instruction.argval), 4)
-                # check that the instructions are all defined
-                defined = False
-                bytecode_fn = getattr(self,
-                                      'byte_%s' % instruction.opname, None)
-                if bytecode_fn is not None:
-                    defined = True
-                elif (instruction.opname.startswith('BINARY_') and
-                      instruction.opname[7:] in self.BINARY_OPERATORS.keys()):
-                    defined = True
-                elif (instruction.opname.startswith('INPLACE_') and
-                      instruction.opname[8:] in self.INPLACE_OPERATORS.keys()):
-                    defined = True
-                elif (instruction.opname.startswith('UNARY_') and
-                      instruction.opname[6:] in self.UNARY_OPERATORS.keys()):
-                    defined = True
-
-                if not defined:
-                    unrecognised.append(instruction.opname)
+            compile_time_error = {'error': error_type,
+                                  'line': error_line
+                                  }
+            return CompiledProgram(False,
+                                   error_type + " on line " + str(error_line),
+                                   compile_time_error=compile_time_error)
+
+        for instruction in dis.get_instructions(code_object):
+            # list bytecode (only at the highest verbosity, since it is
+            # long, and the batch grader compiles a lot of programs)
+            console_msg("\t" + instruction.opname
+                        + str(instruction.argval), 9)
+        # decoding resolves every instruction to its handler,
+        # which also tells us whether they are all defined
+        self.decoded_code = {}
+        unrecognised = self.decode(code_object).unrecognised
         if unrecognised:
             for i in unrecognised:
                 console_msg("UNDEFINED BYTECODE: " + str(i), 2)
-            success = False
-
-        if success:
-            self.byte_code = code_object
-            print('Compiling:')  # actually it was compiled earlier, but nvm
-            print('\t', end='')
-            for c in code_object.co_code:
-                print(c, ', ', sep='', end='')
-            print()
-            msg = "compilation successful"
-        else:
-            if self.compile_time_error:
-                error_msg = self.compile_time_error['error']
-                error_line = self.compile_time_error['line']
-                msg = error_msg + " on line " + str(error_line)
-            elif unrecognised:
-                msg = "Unrecognised bytecode: " + unrecognised[0]
-            else:
-                msg = "Undefined compilation error"
-            self.robot.error(msg, type="Compiler error:")
+            return CompiledProgram(False,
+                                   "Unrecognised bytecode: " + unrecognised[0])
 
-        return success, msg
+        return CompiledProgram(True, "compilation successful",
+                               code_object, self.decoded_code)
 
     ##############################################
     # the functions for the instruction set
@@ -587,10 +1042,12 @@ class VirtualMachine:
         'OR': operator.or_,
     }
 
+    # the operator methods are passed the function from the dicts above,
+    # which is looked up when the instruction is decoded
     def unaryOperator(self, op):
         # handles all the operations that take the form '[op] a', eg 'not a'
         a = self.pop()
-        self.push(self.UNARY_OPERATORS[op](a))
+        self.push(op(a))
 
     def binaryOperator(self, op):
         # handles all the operations that take the form 'a [op] b', eg 2 + 4
@@ -599,7 +1056,7 @@ class VirtualMachine:
         # TEST: CAN I REALLY HAVE MISSED THIS BUG???
         # the line above is being test swapped with the line below
         # this is to fix a subtle bug in list indexing, that surely would have manifested before now
-        self.push(self.BINARY_OPERATORS[op](a, b))
+        self.push(op(a, b))
 
     def inplaceOperator(self, op):
         # handles all the in-place operators
@@ -610,7 +1067,142 @@ class VirtualMachine:
         # TEST: CAN I REALLY HAVE MISSED THIS BUG???
         # the line above is being test swapped with the line below
         # this is to fix a subtle bug in list indexing, that surely would have manifested before now
-        self.push(self.INPLACE_OPERATORS[op](a, b))
+        self.push(op(a, b))
+
+    # operators that can make a list or string longer are checked against
+    # max_list_size, so that a runaway program can't use up all the memory
+    # eg [0] * 10**10, or a = a + a in a loop
+    def multiplyOperator(self, op):
+        # the size is checked before multiplying, because the result
+        # could be too big to make at all
+        a, b = self.popn(2)
+        if type(b) is int and isinstance(a, GROWABLE_TYPES):
+            self.check_size(len(a) * b)
+        elif type(a) is int and isinstance(b, GROWABLE_TYPES):
+            self.check_size(len(b) * a)
+        self.push(op(a, b))
+
+    def addOperator(self, op):
+        # adding can at most double the size, so the result can be
+        # checked afterwards
+        a, b = self.popn(2)
+        result = op(a, b)
+        if isinstance(result, GROWABLE_TYPES):
+            self.check_size(len(result))
+        self.push(result)
+
+    SIZED_OPERATORS = {
+        'MULTIPLY': multiplyOperator,
+        'ADD': addOperator,
+    }
+
+    ##############################################
+    # superinstructions, see fuse_instructions()
+    # each one does the work of a sequence of instructions, and then
+    # moves last_instruction past the ones it has done
+
+    def for_iter_store_name(self, jump, name):
+        # FOR_ITER; STORE_NAME
+        try:
+            v = next(self.stack[-1])
+        except StopIteration:
+            self.stack.pop()
+            self.jump(jump)
+            return
+        frame = self.frame
+        frame.local_names[name] = v
+        if name in self.cached_globals:
+            self.forget_global(name)
+        frame.last_instruction += 2
+
+    def for_iter_store_fast(self, jump, index, name):
+        # FOR_ITER; STORE_FAST
+        try:
+            v = next(self.stack[-1])
+        except StopIteration:
+            self.stack.pop()
+            self.jump(jump)
+            return
+        frame = self.frame
+        frame.fast_locals[index] = v
+        frame.last_instruction += 2
+
+    def name_const_operator_store(self, a, b, op, check_size, result_name):
+        # LOAD_NAME a; LOAD_CONST b; [op]; STORE_NAME result_name
+        frame = self.frame
+        local_names = frame.local_names
+        if a not in local_names:
+            return self.byte_LOAD_NAME(a)  # not the usual case
+        result = op(local_names[a], b)
+        if check_size and isinstance(result, GROWABLE_TYPES):
+            self.check_size(len(result))
+        local_names[result_name] = result
+        if result_name in self.cached_globals:
+            self.forget_global(result_name)
+        frame.last_instruction += 6
+
+    def name_name_operator_store(self, a, b, op, check_size, result_name):
+        # LOAD_NAME a; LOAD_NAME b; [op]; STORE_NAME result_name
+        frame = self.frame
+        local_names = frame.local_names
+        if a not in local_names or b not in local_names:
+            return self.byte_LOAD_NAME(a)  # not the usual case
+        result = op(local_names[a], local_names[b])
+        if check_size and isinstance(result, GROWABLE_TYPES):
+            self.check_size(len(result))
+        local_names[result_name] = result
+        if result_name in self.cached_globals:
+            self.forget_global(result_name)
+        frame.last_instruction += 6
+
+    def fast_const_operator_store(self, a_index, a, b, op, check_size,
+                                  result_index, result_name):
+        # LOAD_FAST a; LOAD_CONST b; [op]; STORE_FAST result_name
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        val = fast_locals[a_index]
+        if val is UNBOUND:
+            return self.byte_LOAD_FAST(a_index, a)
+        result = op(val, b)
+        if check_size and isinstance(result, GROWABLE_TYPES):
+            self.check_size(len(result))
+        fast_locals[result_index] = result
+        frame.last_instruction += 6
+
+    def fast_fast_operator_store(self, a_index, a, b_index, b, op,
+                                 check_size, result_index, result_name):
+        # LOAD_FAST a; LOAD_FAST b; [op]; STORE_FAST result_name
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        val_a = fast_locals[a_index]
+        val_b = fast_locals[b_index]
+        if val_a is UNBOUND or val_b is UNBOUND:
+            return self.byte_LOAD_FAST(a_index, a)
+        result = op(val_a, val_b)
+        if check_size and isinstance(result, GROWABLE_TYPES):
+            self.check_size(len(result))
+        fast_locals[result_index] = result
+        frame.last_instruction += 6
+
+    def name_name_subscript(self, a, b):
+        # LOAD_NAME a; LOAD_NAME b; BINARY_SUBSCR
+        frame = self.frame
+        local_names = frame.local_names
+        if a not in local_names or b not in local_names:
+            return self.byte_LOAD_NAME(a)
+        self.stack.append(local_names[a][local_names[b]])
+        frame.last_instruction += 4
+
+    def name_const_compare_jump(self, a, b, compare, target):
+        # LOAD_NAME a; LOAD_CONST b; COMPARE_OP; POP_JUMP_IF_FALSE target
+        frame = self.frame
+        local_names = frame.local_names
+        if a not in local_names:
+            return self.byte_LOAD_NAME(a)
+        if compare(local_names[a], b):
+            frame.last_instruction += 6
+        else:
+            frame.last_instruction = target
 
     def byte_BUILD_CONST_KEY_MAP(self, size):
         keys = self.pop()
@@ -636,14 +1228,47 @@ class VirtualMachine:
         posargs = self.popn(lenPos)
 
         func = self.pop()
-        # frame = self.frame
-        retval = func(*posargs)
+        return self.call_function(func, posargs, {})
+
+    def byte_CALL_FUNCTION_KW(self, arg_count):
+        # the names of the keyword arguments are on top of the stack,
+        # and their values are the last ones before that
+        names = self.pop()
+        args = self.popn(arg_count)
+        func = self.pop()
+        posargs = args[:arg_count - len(names)]
+        kwargs = dict(zip(names, args[arg_count - len(names):]))
+        return self.call_function(func, posargs, kwargs)
+
+    def call_function(self, func, posargs, kwargs):
+        if isinstance(func, Function):
+            # run student functions in a new frame on this vm, rather than
+            # recursing, so the program can still be suspended
+            self.push_frame(func.make_call_frame(*posargs, **kwargs))
+            return 'call'
+        if func is self.overridden_builtins['input']:
+            # suspend the program until resume_input() supplies the result
+            self.waiting_for_input = True
+            func(*posargs, **kwargs)
+            return 'yield'
+        retval = func(*posargs, **kwargs)
         self.push(retval)
+        if self.update_requested:
+            return 'yield'
+
+    def resume_input(self, result):
+        """ supplies the value returned by input() and lets
+        the program continue """
+        if self.waiting_for_input:
+            self.waiting_for_input = False
+            self.push(result)
 
     def byte_CALL_METHOD(self, arg_count):
         args = self.popn(arg_count)
         obj, method = self.popn(2)
         result = method(*args)
+        if isinstance(obj, list):  # eg append, extend or insert
+            self.check_size(len(obj))
         self.push(result)
 
     COMPARE_OPERATORS = [
@@ -668,6 +1293,11 @@ class VirtualMachine:
         # duplicate the reference on the top of the stack
         self.push(self.top())
 
+    def byte_EXTENDED_ARG(self, ext):
+        # nothing to do: dis has already combined the extended argument
+        # with the argument of the following instruction when decoding
+        pass
+
     def byte_FOR_ITER(self, jump):
         iter_object = self.top()
         try:
@@ -710,6 +1340,7 @@ class VirtualMachine:
         for attr in dir(mod):
             if attr[0] != '_':
                 self.frame.local_names[attr] = getattr(mod, attr)
+                self.forget_global(attr)
 
     def byte_IMPORT_FROM(self, name):
         mod = self.top()
@@ -730,49 +1361,61 @@ class VirtualMachine:
         # Calls list.append(TOS[-i], TOS).
         # Used to implement list comprehensions.
         val = self.pop()
-        list = self.frame.stack[-count]  # peek without popping
+        list = self.stack[-count]  # peek without popping
         list.append(val)
+        self.check_size(len(list))
 
     def byte_LIST_EXTEND(self, count):
         # added LPV v0.4
         # Calls list.extend(TOS1[-i], TOS). Used to build lists.
-        # TODO figure out why LIST_EXTEND needs self.stack
-        # but LIST_APPEND uses self.frame.stack
-        # I don't think I'm implementing frames properly
         val = self.pop()
         list = self.stack[-count]  # peek without popping
         list.extend(val)
+        self.check_size(len(list))
 
     def byte_LOAD_CONST(self, const):
         # add a literal to the stack
         self.push(const)
 
-    def byte_LOAD_FAST(self, name):
-        if name in self.frame.local_names:
-            val = self.frame.local_names[name]
-            self.push(val)
+    def byte_LOAD_FAST(self, index, name):
+        # local variables in functions
+        val = self.frame.fast_locals[index]
+        if val is not UNBOUND:
+            self.stack.append(val)  # same as self.push(), but quicker
         else:
             self.run_time_error = "NAME ERROR: '" + name \
                                   + "' referenced before assignment."
             print(self.run_time_error)
 
-    def byte_LOAD_GLOBAL(self, name):
-        frame = self.frame
-        found = True
-        val = None
-        if name in frame.global_names:
-            val = frame.global_names[name]
-        elif name in self.overridden_builtins:
-            val = self.overridden_builtins[name]
-        elif name in frame.builtin_names:
-            val = frame.builtin_names[name]
-        else:
-            self.run_time_error = "global '" + name \
-                                  + "' is not defined."
-            print("NAME ERROR: " + self.run_time_error)
-            found = False
-        if found:
-            self.push(val)
+    def byte_LOAD_GLOBAL(self, index, name):
+        # global variables and builtins, as seen from inside a function
+        # the value is cached the first time it is looked up, so next
+        # time it's just a list index. The cached value is thrown away if
+        # the global is changed - see forget_global()
+        global_cache = self.frame.global_cache
+        val = global_cache[index]
+        if val is UNBOUND:
+            frame = self.frame
+            if name in frame.global_names:
+                val = frame.global_names[name]
+            elif name in self.overridden_builtins:
+                val = self.overridden_builtins[name]
+            elif name in frame.builtin_names:
+                val = frame.builtin_names[name]
+            else:
+                self.run_time_error = "global '" + name \
+                                      + "' is not defined."
+                print("NAME ERROR: " + self.run_time_error)
+                return
+            global_cache[index] = val
+            self.cached_globals.setdefault(name, []).append(
+                (global_cache, index))
+        self.stack.append(val)
+
+    def forget_global(self, name):
+        # throw away any cached values for this global, after it changes
+        for global_cache, index in self.cached_globals.pop(name, ()):
+            global_cache[index] = UNBOUND
 
     def byte_LOAD_METHOD(self, name):
         object = self.pop()
@@ -798,7 +1441,7 @@ class VirtualMachine:
         if name in frame.local_names:
             val = frame.local_names[name]
         elif name in frame.global_names:
-            val = frame.globals[name]
+            val = frame.global_names[name]
         elif name in self.overridden_builtins:
             val = self.overridden_builtins[name]
         elif name in frame.builtin_names:
@@ -810,12 +1453,19 @@ class VirtualMachine:
         if found:
             self.push(val)
 
-    def byte_MAKE_FUNCTION(self, arg_count):
+    def byte_MAKE_FUNCTION(self, flags):
+        # the flags say which optional extras are on the stack,
+        # under the code and the name
         name = self.pop()
         code = self.pop()
-        defaults = self.popn(arg_count)
+        closure = self.pop() if flags & 0x08 else None
+        if flags & 0x04:
+            self.pop()  # annotations aren't used
+        kwdefaults = self.pop() if flags & 0x02 else None
+        defaults = self.pop() if flags & 0x01 else ()
         globs = self.frame.global_names
-        new_function = Function(name, code, globs, defaults, None, self)
+        new_function = Function(name, code, globs, defaults, closure, self,
+                                kwdefaults)
         self.push(new_function)
 
     def byte_POP_JUMP_IF_FALSE(self, target):
@@ -838,11 +1488,13 @@ class VirtualMachine:
         self.return_value = self.pop()
         return 'return'  # set the value of stack_unwind_reason
 
-    """
     def byte_STORE_ATTR(self, name):
+        # implements TOS.name = TOS1, eg row1[0].water = 3
         val, obj = self.popn(2)
         setattr(obj, name, val)
-"""
+        if self.update_requested:
+            # eg a plot has changed, and should be shown straight away
+            return 'yield'
 
     # THIS IS NOT MENTIONED IN https://docs.python.org/3/library/dis.html
     # IS IT ACTUALLY USED? TODO
@@ -853,9 +1505,18 @@ class VirtualMachine:
 
     def byte_STORE_NAME(self, name):
         self.frame.local_names[name] = self.pop()
+        # at the top level of the program, local names are global
+        if name in self.cached_globals:
+            self.forget_global(name)
 
-    def byte_STORE_FAST(self, name):
-        self.frame.local_names[name] = self.pop()
+    def byte_STORE_GLOBAL(self, name):
+        # assigning to a variable declared global in a function
+        self.frame.global_names[name] = self.pop()
+        if name in self.cached_globals:
+            self.forget_global(name)
+
+    def byte_STORE_FAST(self, index, name):
+        self.frame.fast_locals[index] = self.stack.pop()
 
     def byte_STORE_SUBSCR(self):
         # implements TOS1[TOS] = TOS2
@@ -864,6 +1525,10 @@ class VirtualMachine:
         list = self.pop()
         new_value = self.pop()
         list[index] = new_value
+        if self.update_requested:
+            # changes to the furrows should be shown immediately
+            # (the furrow's ChangeQueue asks for an update)
+            return 'yield'
 
     UNARY_OPERATORS = {
         'POSITIVE': operator.pos,
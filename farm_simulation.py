@@ -0,0 +1,113 @@
+""" advances the state of every plot on the farm as game time passes:
+plants grow, the ground dries out and bugs spread to neighbouring plots """
+import numpy as np
+
+from config import *
+
+
+class FarmSimulation:
+    """ updates a PlotStore in fixed steps of SIMULATION_STEP seconds.
+    advance() is called once per frame with the time since the last
+    frame, and runs however many whole steps are due, so the farm
+    changes at the same rate whatever the frame rate. Each step works on
+    whole columns of the store at once, with NumPy array operations
+    rather than a Python loop over the plots """
+
+    def __init__(self, store, step=SIMULATION_STEP,
+                 max_steps=MAX_SIMULATION_STEPS):
+        self.store = store
+        self.step = step
+        self.max_steps = max_steps
+        self.time_owed = 0.0  # seconds not yet simulated
+        self.steps = 0  # total steps run
+        # bug spread needs each plot's neighbours. The plots are laid
+        # out on a grid with a border of empty cells, and each plot's
+        # row and column in the grid are kept here, so that the grid
+        # can be shifted one cell each way to line up the neighbours
+        self.rows = np.zeros(0, dtype=np.intp)
+        self.cols = np.zeros(0, dtype=np.intp)
+        self.grid = np.zeros((2, 2))
+        self.indexed_plots = -1  # size of the store when the grid was made
+
+    def advance(self, seconds) -> list:
+        """ moves the simulation on by this many seconds, and returns the
+        slots of any plots that have dried out, so they can be redrawn """
+        self.time_owed += seconds
+        steps = int(self.time_owed // self.step)
+        if steps > self.max_steps:
+            # the game has fallen behind (eg the window was dragged),
+            # so skip the missing time rather than trying to catch up
+            steps = self.max_steps
+            self.time_owed = 0.0
+        else:
+            self.time_owed -= steps * self.step
+        dried = []
+        for _ in range(steps):
+            dried.extend(self.tick())
+        return dried
+
+    def tick(self) -> list:
+        """ runs one step for every plot, and returns the slots of any
+        that have dried out """
+        store = self.store
+        water = store.water
+        bugs = store.bugs
+
+        # bugs spread from neighbouring plots
+        # (worked out before anything changes, since growth depends on
+        # the bugs there were at the start of the step)
+        spread = self.get_bug_spread() if bugs.any() else None
+
+        # plants grow if they have water, faster with fertiliser and
+        # slower with bugs, and then the ground dries out a little
+        # (the program can set any value, so only plots with more than
+        # no water are changed)
+        dried = []
+        wet = water > 0
+        if wet.any():
+            growth = (store.growth + GROWTH_RATE * np.minimum(water, 1.0)
+                      * (1 + FERTILISER_BOOST * store.fertiliser)
+                      * (1 - BUG_DAMAGE * bugs))
+            np.copyto(store.growth, np.minimum(growth, 1.0), where=wet)
+            np.copyto(store.fertiliser,
+                      np.maximum(store.fertiliser - FERTILISER_USE, 0.0),
+                      where=wet)
+            # rounded, so the program sees 0.9 rather than 0.8999999...
+            new_water = np.round(np.maximum(water - EVAPORATION, 0.0), 6)
+            dried = np.flatnonzero(wet & (new_water == 0)).tolist()
+            np.copyto(water, new_water, where=wet)
+
+        if spread is not None:
+            np.minimum(bugs + spread, 1.0, out=bugs)
+        self.steps += 1
+        return dried
+
+    def get_bug_spread(self):
+        # the bugs that each plot gains from the plots above, below, left
+        # and right of it, as an array with one value per slot
+        if self.indexed_plots != len(self.store):
+            self.index_cells()
+        rows = self.rows
+        cols = self.cols
+        grid = self.grid
+        # cells without a plot are never set, so they stay at 0
+        grid[rows, cols] = self.store.bugs
+        neighbours = (grid[:-2, 1:-1] + grid[2:, 1:-1]
+                      + grid[1:-1, :-2] + grid[1:-1, 2:])
+        # neighbours has no border, so it is one cell out from the grid
+        return BUG_SPREAD * neighbours[rows - 1, cols - 1]
+
+    def index_cells(self):
+        # works out the grid cell for each plot
+        # this only needs doing again when plots are added
+        store = self.store
+        if len(store):
+            min_x, max_x = int(store.x.min()), int(store.x.max())
+            min_y, max_y = int(store.y.min()), int(store.y.max())
+        else:
+            min_x = max_x = min_y = max_y = 0
+        # one empty cell on each side, so that every plot has neighbours
+        self.rows = (store.y - min_y + 1).astype(np.intp)
+        self.cols = (store.x - min_x + 1).astype(np.intp)
+        self.grid = np.zeros((max_y - min_y + 3, max_x - min_x + 3))
+        self.indexed_plots = len(store)
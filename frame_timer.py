@@ -0,0 +1,117 @@
+""" measures where the time goes in each frame """
+from collections import deque
+import time
+
+from config import FRAME_HISTORY, FRAME_REPORT_INTERVAL
+from console_messages import console_msg
+
+# histogram buckets for frame times, in ms
+# each bucket holds frames up to that length (the last one catches the rest)
+HISTOGRAM_BUCKETS = (8, 17, 33, 50, 100)
+
+
+class FrameTimer:
+    """ times each phase of the game loop (eg input, running the
+    player's program, rendering, flipping the display) over the last few
+    frames, and periodically logs a summary.
+    Call start_frame() at the top of the loop, then start_phase(name)
+    before each part of it, and end_frame() once the frame is over. """
+
+    def __init__(self, history=FRAME_HISTORY,
+                 report_interval=FRAME_REPORT_INTERVAL):
+        self.history = history
+        self.report_interval = report_interval  # in frames, 0 for never
+        self.frame_times = deque(maxlen=history)  # in ms, oldest first
+        self.phase_times = {}  # phase name: deque of ms per frame
+        self._frame_start = None
+        self._phase = None
+        self._phase_start = None
+        self._this_frame = {}  # phase name: ms so far this frame
+        self.frames = 0  # total frames timed
+
+    def start_frame(self):
+        self._frame_start = time.perf_counter()
+        self._phase = None
+        self._this_frame = {}
+
+    def start_phase(self, name):
+        # ends the current phase (if any) and starts timing the next one
+        now = time.perf_counter()
+        self._end_phase(now)
+        self._phase = name
+        self._phase_start = now
+
+    def _end_phase(self, now):
+        if self._phase is not None:
+            self._this_frame[self._phase] = (
+                self._this_frame.get(self._phase, 0)
+                + (now - self._phase_start) * 1000)
+            self._phase = None
+
+    def end_frame(self):
+        # the frame time includes any time spent waiting for the next
+        # frame, so that it reflects the actual frame rate
+        if self._frame_start is None:
+            return
+        now = time.perf_counter()
+        self._end_phase(now)
+        self.frame_times.append((now - self._frame_start) * 1000)
+        for name in self._this_frame:
+            if name not in self.phase_times:
+                self.phase_times[name] = deque(maxlen=self.history)
+        for name, times in self.phase_times.items():
+            times.append(self._this_frame.get(name, 0))
+        self._frame_start = None
+        self.frames += 1
+        if self.report_interval and self.frames % self.report_interval == 0:
+            console_msg(self.report(), 1)
+
+    def get_fps(self) -> float:
+        # average frame rate over the recent history
+        if not self.frame_times:
+            return 0.0
+        return 1000 * len(self.frame_times) / sum(self.frame_times)
+
+    def get_percentile(self, percent) -> float:
+        # the frame time (in ms) that this percentage of recent frames
+        # were no longer than
+        if not self.frame_times:
+            return 0.0
+        ordered = sorted(self.frame_times)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+    def get_phase_average(self, name) -> float:
+        # mean time spent in a phase per frame, in ms
+        times = self.phase_times.get(name)
+        if not times:
+            return 0.0
+        return sum(times) / len(times)
+
+    def get_histogram(self) -> list:
+        # number of recent frames in each bucket of HISTOGRAM_BUCKETS,
+        # plus one more for anything longer
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for frame_time in self.frame_times:
+            bucket = 0
+            while (bucket < len(HISTOGRAM_BUCKETS)
+                   and frame_time > HISTOGRAM_BUCKETS[bucket]):
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def report(self) -> str:
+        # a one-line summary of recent frames, eg
+        # 59.9 fps, 95% < 17.2ms, worst 21.0ms | input 0.1 program 7.9 ...
+        phases = ' '.join('{0} {1:.1f}'.format(name,
+                                               self.get_phase_average(name))
+                          for name in self.phase_times)
+        labels = ['<' + str(limit) for limit in HISTOGRAM_BUCKETS]
+        labels.append('>' + str(HISTOGRAM_BUCKETS[-1]))
+        histogram = ' '.join(label + ':' + str(count) for label, count
+                             in zip(labels, self.get_histogram()))
+        return ('{0:.1f} fps, 95% < {1:.1f}ms, worst {2:.1f}ms'
+                ' | {3} | {4}'.format(self.get_fps(),
+                                      self.get_percentile(95),
+                                      max(self.frame_times, default=0),
+                                      phases, histogram))
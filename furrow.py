@@ -1,26 +1,287 @@
+from array import array
+from numbers import Real
 import string
+
+import numpy as np
+
 from point import Point
 
 
+class PlotStore:
+    """ the state of every plot on the farm, stored column by column.
+    Each plot has a slot number, which indexes all of the columns, so
+    plot 5's water is store.water[5]. The columns are NumPy arrays, which
+    use far less memory than an object per plot on big farms, and let
+    the whole farm be updated with array operations (see FarmSimulation).
+    Adding plots replaces the columns with longer ones, so anything that
+    uses them should look them up again rather than keep hold of them """
+
+    # numeric state of each plot, all starting at zero
+    COLUMNS = ('water', 'fertiliser', 'growth', 'bugs')
+
+    def __init__(self):
+        # grid coords of each plot
+        self.x = np.zeros(0, dtype=np.int32)
+        self.y = np.zeros(0, dtype=np.int32)
+        for name in self.COLUMNS:
+            setattr(self, name, np.zeros(0))
+
+    def add(self, coords: Point) -> int:
+        # make room for a new plot, and return its slot number
+        return self.add_plots([coords])[0]
+
+    def add_plots(self, coords_list) -> range:
+        # make room for several new plots, and return their slot numbers
+        # each call copies the columns, so whole furrows are added at once
+        start = len(self.x)
+        self.x = np.append(self.x, np.array([coords.x for coords
+                                             in coords_list], np.int32))
+        self.y = np.append(self.y, np.array([coords.y for coords
+                                             in coords_list], np.int32))
+        for name in self.COLUMNS:
+            setattr(self, name, np.append(getattr(self, name),
+                                          np.zeros(len(coords_list))))
+        return range(start, len(self.x))
+
+    def get_coords(self, slot) -> Point:
+        return Point(int(self.x[slot]), int(self.y[slot]))
+
+    def __len__(self):
+        return len(self.x)
+
+
+def _column_property(name):
+    # a GrowingPlot attribute that reads and writes the named column of
+    # the plot store, and reports any changes to the furrow
+    def get_value(plot):
+        value = float(getattr(plot.store, name)[plot.slot])
+        # whole numbers are shown without the .0, since that is
+        # what the program will usually have stored
+        if value.is_integer():
+            return int(value)
+        return value
+
+    def set_value(plot, value):
+        # NumPy would also accept strings such as '3', which the
+        # program should get an error for
+        if not isinstance(value, Real):
+            raise TypeError('must be real number, not '
+                            + type(value).__name__)
+        column = getattr(plot.store, name)
+        old = float(column[plot.slot])
+        column[plot.slot] = value
+        if plot.furrow is not None and column[plot.slot] != old:
+            plot.furrow.notify(plot.index, name, old, value, plot)
+
+    return property(get_value, set_value)
+
+
 class GrowingPlot:
     """ a growing plot is the patch of ground that can contain a single plant.
     On the terrain, one tile = one plot. The plot tracks the status of the
-    plant growing on it, plus the amount of moisture, fertiliser, bugs etc """
-    def __init__(self, coords: Point):
-        self.water = 0
-        self.coords = coords
+    plant growing on it, plus the amount of moisture, fertiliser, bugs etc
+    The values themselves are kept in a PlotStore, and this is just a
+    view onto one slot of it. """
+    __slots__ = ('store', 'slot', 'furrow', 'index')
+
+    def __init__(self, store: PlotStore, slot, furrow=None, index=None):
+        self.store = store
+        self.slot = slot
+        # where the plot is, so that changes can be reported. The furrow
+        # keeps these up to date as it changes. If the plot is taken out
+        # of the furrow, index is None
+        self.furrow = furrow
+        self.index = index
+
+    @property
+    def coords(self) -> Point:
+        return self.store.get_coords(self.slot)
+
+    water = _column_property('water')
+    fertiliser = _column_property('fertiliser')
+    growth = _column_property('growth')
+    bugs = _column_property('bugs')
+
 
 class Furrow(list):
     """ A furrow is a list of growing plots. Actions that modify the furrow,
      or the plots within it, should be reflected in some way on the screen.
      In particular, Farmer Bob, should move to the list elements being accessed
-     or modified. """
+     or modified.
+     Changes are reported to a ChangeQueue, if there is one, which the
+     world uses to update the screen.
+     Plots keep their state in a PlotStore, which can be shared between
+     all the furrows on the farm. """
 
-    def __init__(self, name: string, start: Point, end: Point):
+    def __init__(self, name: string, start: Point, end: Point, changes=None,
+                 store=None):
         self.name = name
+        self.changes = changes
+        if store is None:
+            store = PlotStore()
+        self.store = store
+        coords_list = [Point(i, j) for i in range(start.x, end.x+1)
+                       for j in range(start.y, end.y+1)]
         # create a set of all tile coords in the furrow
-        self.tiles_coords = set()
-        for i in range(start.x, end.x+1):
-            for j in range(start.y, end.y+1):
-                self.append(GrowingPlot(Point(i, j)))
-                self.tiles_coords.add(GrowingPlot(Point(i, j)))
+        self.tiles_coords = set(coords_list)
+        # the store slot of each plot, in order. These stay the same even
+        # if the program replaces the plot with something else
+        self.plot_slots = array('i', store.add_plots(coords_list))
+        for index, slot in enumerate(self.plot_slots):
+            # (not self.append(), which would report it as a change)
+            list.append(self, GrowingPlot(store, slot, self, index))
+
+    def get_coords(self, index) -> Point:
+        # the tile that the plot at this index was created on
+        return self.store.get_coords(self.plot_slots[index])
+
+    def get_tile(self, index):
+        # the tile for the element at this index: where the plot is, or
+        # if something else has been put in the furrow (or the index is
+        # past the end), the tile that was there to begin with. None if
+        # the index is past the end of the furrow as it was to begin with
+        if index < len(self):
+            element = list.__getitem__(self, index)
+            if isinstance(element, GrowingPlot):
+                return element.coords
+        if index < len(self.plot_slots):
+            return self.get_coords(index)
+        return None
+
+    def get_all(self) -> list:
+        # a plain list of the elements, without reporting a read
+        return list.__getitem__(self, slice(None))
+
+    # reading an element reports it too, so that the farmer can go and
+    # look at it. Slices aren't reported, since they aren't one place
+
+    def __getitem__(self, index):
+        element = super().__getitem__(index)
+        if (self.changes is not None and self.changes.track_reads
+                and not isinstance(index, slice)):
+            self.notify(range(len(self))[index], 'read', None, element)
+        return element
+
+    def __iter__(self):
+        if self.changes is None or not self.changes.track_reads:
+            return super().__iter__()
+        return self.iterate()
+
+    def iterate(self):
+        # goes through the elements, reporting each one as it is read
+        for index, element in enumerate(list.__iter__(self)):
+            self.notify(index, 'read', None, element)
+            yield element
+
+    # the list methods that change the furrow are all extended to report
+    # which elements have changed, see changed()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            old_length = len(self)
+            removed = list.__getitem__(self, index)
+            super().__setitem__(index, value)
+            self.changed(self.slice_start(index), removed=removed,
+                         old_length=old_length)
+            return
+        start = range(len(self))[index]  # also checks the index
+        removed = list.__getitem__(self, start)
+        super().__setitem__(index, value)
+        self.changed(start, start + 1, removed=(removed,))
+
+    def __delitem__(self, index):
+        old_length = len(self)
+        if isinstance(index, slice):
+            start = self.slice_start(index)
+            removed = list.__getitem__(self, index)
+        else:
+            start = range(len(self))[index]
+            removed = (list.__getitem__(self, start),)
+        super().__delitem__(index)
+        self.changed(start, removed=removed, old_length=old_length)
+
+    def __iadd__(self, other):
+        start = len(self)
+        result = super().__iadd__(other)
+        self.changed(start)
+        return result
+
+    def __imul__(self, count):
+        start = len(self)
+        removed = self.get_all() if count < 1 else ()
+        result = super().__imul__(count)
+        self.changed(0 if removed else start, removed=removed,
+                     old_length=start)
+        return result
+
+    def append(self, value):
+        super().append(value)
+        self.changed(len(self) - 1)
+
+    def extend(self, values):
+        start = len(self)
+        super().extend(values)
+        self.changed(start)
+
+    def insert(self, index, value):
+        # insert() allows any index, and puts the value at the
+        # beginning or end if it is out of range
+        start = max(0, min(index + len(self) if index < 0 else index,
+                           len(self)))
+        super().insert(index, value)
+        self.changed(start)
+
+    def pop(self, index=-1):
+        start = range(len(self))[index]  # raises IndexError like pop()
+        value = super().pop(index)
+        self.changed(start, removed=(value,), old_length=len(self) + 1)
+        return value
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def clear(self):
+        removed = self.get_all()
+        super().clear()
+        self.changed(0, removed=removed, old_length=len(removed))
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.changed(0)
+
+    def reverse(self):
+        super().reverse()
+        self.changed(0)
+
+    def slice_start(self, index: slice) -> int:
+        # the first position affected by a slice
+        # (extended slices can affect the list anywhere)
+        start, stop, step = index.indices(len(self))
+        return start if step == 1 else 0
+
+    def changed(self, start, stop=None, removed=(), old_length=0):
+        """ reports that the elements from start (up to stop, or the end
+        of the furrow) have been replaced or moved, and updates the
+        position of any plots among them. removed is anything that was
+        taken out of the furrow. If the furrow is now shorter than
+        old_length, the positions past the end are reported as empty """
+        for element in removed:
+            if isinstance(element, GrowingPlot) and element.furrow is self:
+                element.index = None
+        if stop is None or stop > len(self):
+            stop = len(self)
+        for index in range(start, stop):
+            element = list.__getitem__(self, index)
+            if isinstance(element, GrowingPlot):
+                # this also puts back anything that was removed from one
+                # place but is still in the furrow somewhere else
+                element.furrow = self
+                element.index = index
+            self.notify(index, 'plot', None, element)
+        for index in range(max(start, len(self)), old_length):
+            self.notify(index, 'plot', None, None)
+
+    def notify(self, index, field, old, new, plot=None):
+        # report a change to the element at this index
+        if self.changes is not None:
+            self.changes.put(self, index, field, old, new, plot)
@@ -0,0 +1,54 @@
+""" a stand-in for World that runs farm programs without a display,
+eg for testing or grading lots of programs at once.
+Nothing is drawn: programs act on the farmer and furrows as normal, but
+speech and errors are only recorded, and the interpreter runs the whole
+program in one go instead of a little each frame. """
+import os
+
+# nothing should need a display, but if anything does create a
+# surface, it mustn't open a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import characters
+from config import *
+from furrow import Furrow
+
+
+class HeadlessWorld:
+    def __init__(self, furrows=None, inputs=()):
+        self.headless = True
+        # the same starting plots as World, unless told otherwise
+        if furrows is None:
+            furrows = [Furrow('row1', Point(0, 3), Point(5, 3))]
+        self.furrows = furrows
+        # answers for any calls to input(), in order
+        self.inputs = list(inputs)
+        self.farmer = characters.Farmer("Bob",
+                                        self,
+                                        None,  # no sprite
+                                        Point(2, 4),
+                                        1.0,
+                                        self.furrows)
+
+    def next_input(self):
+        # returns the next prepared input, or None if there aren't any left
+        if self.inputs:
+            return self.inputs.pop(0)
+        return None
+
+    def run_program(self, source_lines):
+        """ compiles and runs a program (a list of lines) as the farmer,
+        and returns (success, result). If the program fails, result is
+        a list of error messages. What the farmer says is in
+        self.farmer.output """
+        self.farmer.clear_all_output()
+        vm = self.farmer.python_interpreter
+        vm.load(source_lines)
+        success, errors = vm.compile()
+        if success is False:
+            return False, errors
+        return vm.run()
+
+    def busy(self):
+        # there are no animations to wait for
+        return False
@@ -13,9 +13,12 @@ class Panel:
         self._panel.fill("red")  # for colour keying
         self._panel.set_colorkey("red")
         self.border_width = 5
+        self.version = 0
         self.redraw()
 
     def redraw(self):
+        # counts redraws, so the world can tell when the panel has changed
+        self.version += 1
         # fill the middle
         pygame.draw.rect(self._panel, UI_BACKGROUND,
                          pygame.Rect(
@@ -34,6 +37,10 @@ class Panel:
         # draw the panel
         self.display.blit(self._panel, self.position)
 
+    def get_rect(self) -> pygame.Rect:
+        # the area of the screen covered by the panel
+        return self._panel.get_rect(topleft=self.position)
+
     def mouse_over(self) -> bool:
         # return true if the mouse cursor is over the panel
         return self._panel.get_rect().collidepoint(pygame.mouse.get_pos())
@@ -0,0 +1,53 @@
+""" finds the furrow and plot on any tile of the farm, without searching """
+from collections import namedtuple
+
+from point import Point
+
+# what is on a tile: the plot, and the furrow and position it is in now
+# (furrow and index are None if the plot has been taken out of its furrow)
+TileContents = namedtuple('TileContents', ['furrow', 'index', 'plot'])
+
+
+class PlotIndex:
+    """ maps the grid coords of each cultivated tile to the plot on it.
+    Plots never move between tiles, so this only changes when furrows
+    are added. Where each plot is in its furrow is kept up to date by the
+    furrow itself (see Furrow.changed), so a lookup is always current,
+    however the program has rearranged the furrows.
+    Iterating over the index gives the coords of every cultivated tile """
+
+    def __init__(self, furrows=()):
+        self.tiles = {}  # Point: GrowingPlot
+        for furrow in furrows:
+            self.add_furrow(furrow)
+
+    def add_furrow(self, furrow):
+        for index in range(len(furrow.plot_slots)):
+            plot = list.__getitem__(furrow, index)
+            self.tiles[plot.coords] = plot
+
+    def remove_furrow(self, furrow):
+        for index in range(len(furrow.plot_slots)):
+            coords = furrow.get_coords(index)
+            if self.tiles.get(coords) is not None \
+                    and self.tiles[coords].slot == furrow.plot_slots[index]:
+                del self.tiles[coords]
+
+    def get(self, coords: Point):
+        # returns the TileContents at these grid coords, or None if the
+        # tile isn't cultivated
+        plot = self.tiles.get(coords)
+        if plot is None:
+            return None
+        if plot.index is None:
+            return TileContents(None, None, plot)
+        return TileContents(plot.furrow, plot.index, plot)
+
+    def __contains__(self, coords):
+        return coords in self.tiles
+
+    def __iter__(self):
+        return iter(self.tiles)
+
+    def __len__(self):
+        return len(self.tiles)
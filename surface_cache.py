@@ -0,0 +1,53 @@
+""" least-recently-used caching for pre-rendered surfaces """
+from collections import OrderedDict
+
+import pygame
+
+
+class SurfaceCache:
+    """ keeps pre-rendered surfaces, keyed by anything hashable.
+    The total size of the cache is limited by number of pixels rather than
+    number of surfaces, since big and small surfaces cost very different
+    amounts of memory. When the limit is exceeded, the surfaces that
+    haven't been used for the longest are thrown away."""
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.pixels = 0  # total size of all cached surfaces
+        self._surfaces = OrderedDict()  # oldest first
+
+    def __contains__(self, key):
+        return key in self._surfaces
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def get(self, key):
+        # returns the surface, or None if it isn't in the cache
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)  # most recently used
+        return surface
+
+    def put(self, key, surface: pygame.Surface):
+        self.discard(key)
+        self._surfaces[key] = surface
+        self.pixels += surface.get_width() * surface.get_height()
+        # evict least recently used, but never the one just added
+        while self.pixels > self.max_pixels and len(self._surfaces) > 1:
+            oldest = next(iter(self._surfaces))
+            self.discard(oldest)
+
+    def discard(self, key):
+        surface = self._surfaces.pop(key, None)
+        if surface is not None:
+            self.pixels -= surface.get_width() * surface.get_height()
+
+    def discard_if(self, test):
+        # remove every surface whose key passes test(key)
+        for key in [k for k in self._surfaces if test(k)]:
+            self.discard(key)
+
+    def clear(self):
+        self._surfaces.clear()
+        self.pixels = 0
@@ -1,11 +1,14 @@
 # Handles isometric ground tiles and static scenery elements
 
+import math
 import random
 import pygame
 import pygame.gfxdraw
 import spritesheet
-from camera import Camera
+from camera import Camera, quantise_zoom
 from config import *
+from surface_cache import SurfaceCache
+from tile_grid import TileGrid
 
 
 class Terrain:
@@ -15,8 +18,17 @@ class Terrain:
         self.original_block_size = 256  # default for zoom = 1.0
         self.zoom = zoom
         self.cultivated = cultivated
-        # signals that the landscape should be regenerated from tiles
-        self.landscape_cache_dirty = True
+        # the landscape is drawn from pre-rendered chunks of tiles, keyed
+        # by (chunk row, chunk col, block size, rotation) so that
+        # chunks for other zoom levels and orientations can be kept too
+        self.chunk_cache = SurfaceCache(LANDSCAPE_CACHE_PIXELS)
+        # transforms between grid coords and pixels, keyed by
+        # (block size, rotation). See get_transforms()
+        self.transform_cache = {}
+        # areas that have been redrawn since the last call to
+        # take_dirty_rects(), relative to the top left of the grid
+        # None means that everything might have changed
+        self.dirty_rects = []
 
         # load all tile images from the spritesheet
         # replaced by procedurally drawn tiles, for now
@@ -43,109 +55,280 @@ class Terrain:
             "gold"       : GOLD,
             "tan"        : TAN,
             "brown"      : BROWN,
+            "wet soil"   : WET_SOIL,
         }
 
-        # build a dict all all tile types, keyed by colour
-        # the change_zoom() function recreates all the tiles anyway, so
-        # we can just use that
-        self.all_tiles = {}
+        # tiles are drawn the first time they are needed at each zoom
+        # level, and cached by (colour, block size)
+        self.tile_cache = SurfaceCache(TILE_CACHE_PIXELS)
         self.change_zoom(self.zoom)
 
         # build the grid of tile colours representing the terrain tiles
         # this might eventually be read from a file
         self.columns = width
         self.rows = length
-        self.tile_grid = []
-        for x in range(width):
-            row = []
-            for y in range(length):
-                if Point(x,y) in self.cultivated:
-                    tile = BROWN
-                else:
-                    tile = DARK_GREEN
-                row.append(tile)
-            self.tile_grid.append(row)
+        # tiles are addressed by their grid coords (x, y), which stay
+        # the same whichever way round the terrain is viewed
+        # The grid stores a one-byte ID for each tile, and the palette
+        # maps these IDs back to colours
+        self.palette = list(self.tile_colours.values())
+        self.tile_ids = {colour: tile_id
+                         for tile_id, colour in enumerate(self.palette)}
+        self.tile_grid = TileGrid(width, length, self.tile_ids[DARK_GREEN])
+        # only the cultivated tiles need visiting, not the whole grid
+        for coords in self.cultivated:
+            if 0 <= coords.x < width and 0 <= coords.y < length:
+                self.tile_grid.set_base(coords, self.tile_ids[BROWN])
 
         # set the colour of all furrows
 
 
-        # generate a single image composed of the tiles arranged in the grid
-        self.landscape = self.regen_landscape()
-
     @property
     def display(self):
         return self._display
 
-    def update(self, centred_on):
-        # render the current landscape with the correct x,y panning
-        if self.landscape_cache_dirty:
-            self.landscape = self.regen_landscape()
-        return self.landscape
+    def update(self, origin: Point):
+        # draw the visible parts of the landscape onto the display, with the
+        # top left of the tile grid at the screen position origin.
+        # Each chunk is only rendered the first time it is needed, so
+        # panning around is just a matter of blitting a few cached chunks
+        self.display.fill(SKY_BLUE)
+        screen_rect = self.display.get_rect()
+        for chunk_row, chunk_col in self.get_visible_chunks(origin):
+            chunk_rect = self.get_chunk_rect(chunk_row, chunk_col).move(origin)
+            if chunk_rect.colliderect(screen_rect):
+                self.display.blit(self.get_chunk(chunk_row, chunk_col),
+                                  chunk_rect)
+
+    def get_origin(self, viewpoint: Point) -> Point:
+        # screen position of the top left of the tile grid,
+        # for a given viewpoint
+        size = self.get_landscape_size()
+        return Point(self.display.get_width() - size.x // 2 - viewpoint.x,
+                     self.display.get_height() - size.y // 2 - viewpoint.y)
+
+    def get_landscape_size(self) -> Point:
+        # the space needed for the whole tile grid
+        tile_inc = self.get_tile_increment()
+        rows = self.get_rows()
+        cols = self.get_cols()
+        return Point(tile_inc.x * (rows + cols),
+                     tile_inc.y * (rows + cols + 1))
+
+    @property
+    def rotation(self):
+        return self.tile_grid.rotation
+
+    def set_tile(self, grid_position: Point, colour):
+        # change the colour of a single tile, at grid coords (x, y)
+        # only the chunk containing the tile is affected, and if it is
+        # cached, the tile (and its neighbours) are redrawn in place
+        tile_id = self.tile_ids[colour]
+        if self.tile_grid.get_base(grid_position) == tile_id:
+            return
+        self.tile_grid.set_base(grid_position, tile_id)
+
+        def out_of_date(key):
+            # any cached chunk that contains this tile, except for the
+            # current zoom level and rotation, which is redrawn below
+            chunk_row, chunk_col, block_size, rotation = key
+            if block_size == self.block_size and rotation == self.rotation:
+                return False
+            row, col = self.tile_grid.from_base(grid_position, rotation)
+            chunk_size = self.get_chunk_size(block_size)
+            return (chunk_row == row // chunk_size
+                    and chunk_col == col // chunk_size)
+        self.chunk_cache.discard_if(out_of_date)
+
+        row, col = self.tile_grid.from_base(grid_position)
+        chunk_size = self.get_chunk_size(self.block_size)
+        chunk_row = row // chunk_size
+        chunk_col = col // chunk_size
+        chunk = self.chunk_cache.get(self.get_chunk_key(chunk_row, chunk_col))
+        if chunk is not None:
+            self.redraw_tile(chunk, chunk_row, chunk_col, row, col)
+        if self.dirty_rects is not None:
+            self.dirty_rects.append(self.get_tile_rect(row, col))
+
+    def take_dirty_rects(self):
+        # returns the areas of the landscape that have changed since the
+        # last call, relative to the top left of the grid
+        # or None if the whole landscape needs redrawing
+        dirty_rects = self.dirty_rects
+        self.dirty_rects = []
+        return dirty_rects
+
+    def get_tile_rect(self, row, col) -> pygame.Rect:
+        # the area covered by a tile, relative to the top left of the grid
+        tile_inc = self.get_tile_increment()
+        return pygame.Rect(
+            (self.get_rows() - 1 - row + col) * tile_inc.x,
+            (row + col) * tile_inc.y,
+            self.block_size,
+            self.block_size
+        )
+
+    def get_chunk_size(self, block_size) -> int:
+        # number of tiles along each side of a chunk
+        # at high zoom, chunks contain fewer tiles so they don't get huge
+        return max(1, min(CHUNK_SIZE, CHUNK_MAX_WIDTH // block_size))
+
+    def get_chunk_key(self, chunk_row, chunk_col):
+        return chunk_row, chunk_col, self.block_size, self.rotation
+
+    def get_chunk_tiles(self, chunk_row, chunk_col):
+        # returns the range of rows and cols covered by a chunk
+        # chunks at the edge of the grid may be smaller than the rest
+        chunk_size = self.get_chunk_size(self.block_size)
+        first_row = chunk_row * chunk_size
+        first_col = chunk_col * chunk_size
+        return (range(first_row, min(self.get_rows(), first_row + chunk_size)),
+                range(first_col, min(self.get_cols(), first_col + chunk_size)))
+
+    def get_chunk_rect(self, chunk_row, chunk_col) -> pygame.Rect:
+        # the area covered by a chunk, relative to the top left of the grid
+        # this is the bounding box of its left, right, top and bottom tiles
+        rows, cols = self.get_chunk_tiles(chunk_row, chunk_col)
+        top_left = self.get_tile_rect(rows[-1], cols[0]).left
+        top = self.get_tile_rect(rows[0], cols[0]).top
+        right = self.get_tile_rect(rows[0], cols[-1]).right
+        bottom = self.get_tile_rect(rows[-1], cols[-1]).bottom
+        return pygame.Rect(top_left, top, right - top_left, bottom - top)
 
-    def regen_landscape(self) -> pygame.Surface:
-        # assembles all the tiles in the map into a single image
-        # this only needs to be done when one of the tiles changes
-        # or the map is zoomed or rotated.
-        # The rest of the time, the cached landscape can be used.
+    def get_chunk(self, chunk_row, chunk_col) -> pygame.Surface:
+        # returns the pre-rendered chunk, rendering it if necessary
+        key = self.get_chunk_key(chunk_row, chunk_col)
+        chunk = self.chunk_cache.get(key)
+        if chunk is None:
+            chunk = self.render_chunk(chunk_row, chunk_col)
+            self.chunk_cache.put(key, chunk)
+        return chunk
 
+    def render_chunk(self, chunk_row, chunk_col) -> pygame.Surface:
+        # assembles all the tiles in a chunk into a single image
+        # the background is transparent, so that the chunks can overlap
+        # each other the same way that tiles do
+        chunk_rect = self.get_chunk_rect(chunk_row, chunk_col)
+        chunk = pygame.Surface(chunk_rect.size).convert()
+        chunk.fill("red")  # for colour keying - don't use red on tiles
+        chunk.set_colorkey("red")
+        rows, cols = self.get_chunk_tiles(chunk_row, chunk_col)
+        for row in rows:
+            for col in cols:
+                chunk.blit(self.get_tile_by_id(self.tile_grid.get(row, col)),
+                           self.get_tile_rect(row, col).move(
+                               -chunk_rect.x, -chunk_rect.y))
+        return chunk
+
+    def redraw_tile(self, chunk, chunk_row, chunk_col, row, col):
+        # redraw just one tile, reusing the existing chunk surface.
+        # Isometric tiles overlap their neighbours, so every tile in
+        # the chunk that touches the changed area is redrawn as well,
+        # clipped to that area, in the same back-to-front order used by
+        # render_chunk. Tiles in other chunks are on their own surfaces.
+        # Tiles more than 3 rows or columns away can't overlap
+        NEIGHBOURS = 3
+        chunk_rect = self.get_chunk_rect(chunk_row, chunk_col)
+        offset = (-chunk_rect.x, -chunk_rect.y)
+        dirty_rect = self.get_tile_rect(row, col).move(offset)
+        rows, cols = self.get_chunk_tiles(chunk_row, chunk_col)
+        chunk.set_clip(dirty_rect)
+        chunk.fill("red")
+        for r in range(max(rows[0], row - NEIGHBOURS),
+                       min(rows[-1], row + NEIGHBOURS) + 1):
+            for c in range(max(cols[0], col - NEIGHBOURS),
+                           min(cols[-1], col + NEIGHBOURS) + 1):
+                tile_rect = self.get_tile_rect(r, c).move(offset)
+                if tile_rect.colliderect(dirty_rect):
+                    chunk.blit(self.get_tile_by_id(self.tile_grid.get(r, c)),
+                               tile_rect)
+        chunk.set_clip(None)
+
+    def get_visible_chunks(self, origin: Point):
+        # generates the (row, col) of every chunk that may be visible on
+        # screen, in back-to-front order.
+        # Working in isometric coordinates, u = col - row runs left to right
+        # across the screen and v = row + col runs top to bottom, so the
+        # visible tiles fall in a simple range of u and v, and so do the
+        # chunks that contain them.
+        # Drawing in order of increasing v gets the overlaps right.
+        # Chunks (and tiles) with the same v only overlap by a pixel (when
+        # the block size is odd), and they are drawn right to left, the
+        # same as going down the rows of the grid.
         tile_inc = self.get_tile_increment()
-        # calculate the space needed for the whole tile grid
         rows = self.get_rows()
         cols = self.get_cols()
-        min_x = -tile_inc.x * rows
-        max_x = tile_inc.x * cols
-        min_y = 0
-        max_y = tile_inc.y * (rows + cols+1) #+ tile_x_increment
-        size = (max_x - min_x, max_y - min_y)
-        landscape = pygame.Surface(size)
-        landscape.fill(SKY_BLUE)
-
-        # calculate the start position for the top left of the grid
-        # so that it exactly fits on the grid
-        start_x = (rows-1) * tile_inc.x
-        start_y = 0
-
-        for row in self.tile_grid:
-            x = start_x
-            y = start_y
-            for colour in row:
-                landscape.blit(
-                    self.get_tile(colour),
-                    (x, y))
-                x += tile_inc.x
-                y += tile_inc.y
-            start_x -= tile_inc.x
-            start_y += tile_inc.y
-        self.landscape_cache_dirty = False  # because we have just updated
-        return landscape
+        width, height = self.display.get_size()
+        # a tile's x = origin.x + (rows - 1 + u) * tile_inc.x, which must be
+        # within one tile width of the screen. Likewise for y
+        min_u = (-origin.x - self.block_size) // tile_inc.x - (rows - 1)
+        max_u = (width - origin.x) // tile_inc.x - (rows - 1)
+        min_v = (-origin.y - self.block_size) // tile_inc.y
+        max_v = (height - origin.y) // tile_inc.y
+        # a chunk of n x n tiles covers u from (its u) * n - (n - 1)
+        # to (its u) * n + (n - 1), and v from (its v) * n to
+        # (its v) * n + 2 * (n - 1)
+        n = self.get_chunk_size(self.block_size)
+        chunk_rows = (rows + n - 1) // n
+        chunk_cols = (cols + n - 1) // n
+        min_u = max(-(chunk_rows - 1), (min_u - (n - 1)) // n)
+        max_u = min(chunk_cols - 1, (max_u + n - 1) // n)
+        min_v = max(0, (min_v - 2 * (n - 1)) // n)
+        max_v = min(chunk_rows + chunk_cols - 2, max_v // n)
+        for v in range(min_v, max_v + 1):
+            # row and col are only whole numbers when u and v are both
+            # odd or both even
+            start_u = max_u - (max_u + v) % 2
+            for u in range(start_u, min_u - 1, -2):
+                chunk_row = (v - u) // 2
+                chunk_col = (v + u) // 2
+                if 0 <= chunk_row < chunk_rows and 0 <= chunk_col < chunk_cols:
+                    yield chunk_row, chunk_col
 
     def rotate(self):
-        # transpose the terrain grid to rotate the landscape through 90 degrees
-        # this is a relatively slow method
-        # could use zip() or the numpy library, if we need more speed
-        rotated = []
-        for i in range(len(self.tile_grid[0])):
-            transposed_row = []
-            for row in self.tile_grid:
-                transposed_row.insert(0, row[i])
-            rotated.append(transposed_row)
-        self.tile_grid = rotated
-        self.landscape_cache_dirty = True
+        # rotate the landscape through 90 degrees
+        # this just changes which way round the tile grid is viewed, and
+        # chunks are cached for each rotation, so switching back to a
+        # recently seen orientation doesn't need anything redrawn
+        self.tile_grid.rotate()
+
+    def recolour(self, old_colour, new_colour):
+        # change every tile of one colour to another, all in one go
+        # eg to show all the cultivated tiles being watered
+        changed = self.tile_grid.translate({self.tile_ids[old_colour]:
+                                            self.tile_ids[new_colour]})
+        if changed:
+            # the changes could be anywhere, so all the chunks are stale
+            self.chunk_cache.clear()
+            self.dirty_rects = None
+
+    def get_colour(self, grid_position: Point):
+        # the colour of the tile at grid coords (x, y)
+        return self.palette[self.tile_grid.get_base(grid_position)]
+
+    def get_tile_by_id(self, tile_id) -> pygame.Surface:
+        return self.get_tile(self.palette[tile_id])
 
     def get_tile(self, colour) -> pygame.Surface:
-        # returns a pre-zoomed tile surface from the cached dict
-        return self.all_tiles[colour]
+        # returns a pre-zoomed tile surface from the cache
+        key = (colour, self.block_size)
+        tile = self.tile_cache.get(key)
+        if tile is None:
+            tile = self.draw_tile(self.zoom, colour)
+            self.tile_cache.put(key, tile)
+        return tile
 
     def change_zoom(self, new_zoom):
-        # rescale all the tiles in the cached dict
-        for colour in self.tile_colours.values():
-            self.all_tiles[colour] = self.draw_tile(new_zoom, colour)
-        self.landscape_cache_dirty = True
+        # switch to the nearest zoom level
+        # tiles and chunks are cached for each zoom level, so nothing needs
+        # to be redrawn unless this level hasn't been seen recently
+        self.zoom = quantise_zoom(new_zoom)
+        self.block_size = int(self.original_block_size * self.zoom)
 
     def draw_tile(self, zoom, top_face_colour) -> pygame.Surface:
         # procedurally create a single, flat terrain tile
-        self.block_size = int(self.original_block_size * zoom)
-        canvas = pygame.Surface((self.block_size, self.block_size))
+        block_size = int(self.original_block_size * zoom)
+        canvas = pygame.Surface((block_size, block_size))
         # the tile is sized to fill the canvas
         # turn lines off when the grid is too small
         line_width = min(1, int(6 * zoom))
@@ -175,30 +358,91 @@ class Terrain:
         return canvas
 
     def get_rows(self) -> int:
-        # number of tiles per column
-        return len(self.tile_grid)
+        # number of tiles per column, in the current view
+        return self.tile_grid.get_rows()
 
     def get_cols(self) -> int:
-        # number of tiles per row):
-        return len(self.tile_grid[0])
+        # number of tiles per row, in the current view
+        return self.tile_grid.get_cols()
 
     def get_tile_increment(self) -> Point:
         return Point(self.block_size // 2, self.block_size // 4)
 
     def get_ground_coords(self, grid_position: Point) -> Point:
         # convert tile grid coords to pixel coords
-        # the x coord of the bottom-left corner of the bottom-left tile
-        # is always 0, and the top-right corner of the top-right tile is
-        # always at x = terrain width
-        # because the terrain surface is sized to exactly fit
-        # so we can calculate the position of any tile using just the terrain
-        # rectangle and the size of one tile
-
-        tx = self. get_tile_increment().x
-        ty = self.get_tile_increment().y
-        r = self.get_rows()
-        screen_pos = Point(
-            (tx * (r - grid_position.y) + tx * grid_position.x),
-            (r * ty - (r - grid_position.y) * ty + ty * grid_position.x)
-        )
-        return screen_pos
+        # relative to the top left of the whole tile grid, which is
+        # positioned on screen by get_origin().
+        # The result is the middle of the top edge of the tile's bounding
+        # box, taking into account which way round the terrain is viewed
+        return self.grid_to_screen((grid_position,), Point(0, 0))[0]
+
+    def get_transforms(self):
+        # returns the coefficients of the transforms between grid coords
+        # and the screen, for the current zoom and rotation.
+        # Converting grid coords to ground pixels is a linear transform:
+        # px = a * x + b * y + c, and likewise for py. So is converting
+        # (row, col) in the current view back to grid coords.
+        # Rather than doing the algebra for each rotation, the coefficients
+        # are found from 3 sample points, and cached
+        key = (self.block_size, self.rotation)
+        transforms = self.transform_cache.get(key)
+        if transforms is None:
+            def ground(grid_position):
+                row, col = self.tile_grid.from_base(grid_position)
+                tile_rect = self.get_tile_rect(row, col)
+                return Point(tile_rect.centerx, tile_rect.top)
+            to_ground = linear_coefficients(ground)
+            to_grid = linear_coefficients(
+                lambda view: self.tile_grid.to_base(*view))
+            transforms = (to_ground, to_grid)
+            self.transform_cache[key] = transforms
+        return transforms
+
+    def grid_to_screen(self, grid_positions, origin: Point):
+        # converts a batch of grid coords to the screen position of the
+        # middle of the top edge of each tile's bounding box,
+        # when the top left of the tile grid is at origin
+        (ax, bx, cx, ay, by, cy), _ = self.get_transforms()
+        cx += origin[X]
+        cy += origin[Y]
+        return [Point(ax * x + bx * y + cx, ay * x + by * y + cy)
+                for x, y in grid_positions]
+
+    def screen_to_grid(self, screen_positions, origin: Point):
+        # converts a batch of screen positions to the grid coords of the
+        # tile under each one (ie whose top face contains the position),
+        # or None if there is no tile there
+        # The centre of the top face of the tile at (row, col) in the
+        # current view is at x = (rows - 1 + col - row) * tx + tx,
+        # y = (row + col) * ty + ty and the face is a diamond, so
+        # rounding the inverse of this to whole numbers picks the
+        # right tile
+        _, (ax, bx, cx, ay, by, cy) = self.get_transforms()
+        tx, ty = self.get_tile_increment()
+        x_offset = origin[X] + self.get_rows() * tx
+        y_offset = origin[Y] + ty
+        base_rows = self.tile_grid.base_rows
+        base_cols = self.tile_grid.base_cols
+        grid_positions = []
+        for screen_x, screen_y in screen_positions:
+            u = (screen_x - x_offset) / tx  # col - row
+            v = (screen_y - y_offset) / ty  # row + col
+            row = math.floor((v - u) / 2 + 0.5)
+            col = math.floor((v + u) / 2 + 0.5)
+            x = ax * row + bx * col + cx
+            y = ay * row + by * col + cy
+            if 0 <= x < base_rows and 0 <= y < base_cols:
+                grid_positions.append(Point(x, y))
+            else:
+                grid_positions.append(None)
+        return grid_positions
+
+
+def linear_coefficients(transform):
+    # finds a, b, c, d, e, f such that
+    # transform(x, y) = (a*x + b*y + c, d*x + e*y + f)
+    # for a transform that is known to be linear
+    c, f = transform((0, 0))
+    a, d = transform((1, 0))
+    b, e = transform((0, 1))
+    return a - c, b - c, c, d - f, e - f, f
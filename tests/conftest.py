@@ -0,0 +1,6 @@
+""" lets the tests import the game's modules, without opening a window """
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
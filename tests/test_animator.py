@@ -0,0 +1,97 @@
+""" Animator: playing out the farmer's actions over several frames """
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+from animator import Animator
+from point import Point
+
+
+@pytest.fixture
+def farmer():
+    return SimpleNamespace(position=Point(0, 0))
+
+
+def make_animator(farmer, **options):
+    settings = dict(speed=2, action_time=0.5, pipeline=3, max_queue=10)
+    settings.update(options)
+    animator = Animator(farmer, **settings)
+    animator.fast_forward = False
+    return animator
+
+
+def test_the_character_walks_at_its_speed(farmer):
+    animator = make_animator(farmer)
+    animator.move(Point(4, 0))
+    animator.update(1)
+    assert farmer.position == Point(2, 0)
+    assert len(animator) == 1
+    animator.update(1)
+    assert farmer.position == Point(4, 0)
+    assert len(animator) == 0
+
+
+def test_actions_finish_after_action_time(farmer):
+    animator = make_animator(farmer)
+    done = []
+    animator.act('water', Point(0, 0), lambda: done.append(True))
+    animator.update(0.3)
+    assert done == []
+    animator.update(0.3)
+    assert done == [True]
+
+
+def test_time_left_over_is_used_by_the_next_action(farmer):
+    animator = make_animator(farmer)
+    done = []
+    animator.move(Point(1, 0))
+    animator.act('water', Point(1, 0), lambda: done.append(True))
+    # half a second to walk there, and half a second to water
+    animator.update(1)
+    assert farmer.position == Point(1, 0)
+    assert done == [True]
+
+
+def test_moves_are_kept_unless_the_target_is_where_it_will_be(farmer):
+    animator = make_animator(farmer)
+    animator.move(Point(0, 0))
+    assert len(animator) == 0
+    animator.move(Point(1, 0))
+    animator.move(Point(2, 0))
+    animator.move(Point(2, 0))
+    assert len(animator) == 2
+    assert animator.get_final_position() == Point(2, 0)
+
+
+def test_fast_forward_finishes_everything_at_once(farmer):
+    animator = make_animator(farmer)
+    done = []
+    animator.move(Point(10, 10))
+    animator.act('water', Point(10, 10), lambda: done.append(True))
+    animator.fast_forward = True
+    assert not animator.busy()
+    animator.update(0)
+    assert farmer.position == Point(10, 10)
+    assert done == [True]
+    assert len(animator) == 0
+
+
+def test_the_oldest_actions_are_skipped_when_the_queue_is_full(farmer):
+    animator = make_animator(farmer, max_queue=2)
+    done = []
+    for x in range(1, 4):
+        animator.act('water', Point(x, 0), partial(done.append, x))
+    assert done == [1]
+    assert len(animator) == 2
+
+
+def test_busy_once_the_pipeline_is_full(farmer):
+    animator = make_animator(farmer, pipeline=2)
+    animator.move(Point(1, 0))
+    assert not animator.busy()
+    animator.move(Point(2, 0))
+    assert animator.busy()
+    animator.skip()
+    assert not animator.busy()
+    assert farmer.position == Point(2, 0)
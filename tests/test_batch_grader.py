@@ -0,0 +1,69 @@
+""" the batch grader, which runs a folder of saved programs """
+import json
+
+import pytest
+
+from furrow import Furrow
+from point import Point
+
+# the grader runs programs in a headless world, which needs the rest of
+# the game to be importable
+batch_grader = pytest.importorskip('batch_grader')
+
+
+def write_programs(folder, programs):
+    for name, source in programs.items():
+        (folder / name).write_text(source)
+
+
+def read_results(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_furrow_state_records_plots_and_other_elements():
+    furrow = Furrow('row1', Point(0, 3), Point(2, 3))
+    furrow[0].water = 2
+    furrow[1] = 'rock'
+    furrow.append(None)
+    assert batch_grader.furrow_state(furrow) == [
+        {'coords': [0, 3], 'water': 2},
+        {'coords': [1, 3], 'water': None, 'value': "'rock'"},
+        {'coords': [2, 3], 'water': 0},
+        {'coords': None, 'water': None, 'value': 'None'}]
+
+
+def test_grade_file_records_what_the_program_did(tmp_path):
+    write_programs(tmp_path, {'a.py': "print(row1[0].water + 2)\n"})
+    result = batch_grader.grade_file(str(tmp_path / 'a.py'))
+    assert result['file'] == 'a.py'
+    assert result['success'] is True
+    assert result['errors'] == []
+    assert result['output'] == ['2']
+    assert result['instructions'] > 0
+    assert result['furrows']['row1'][0] == {'coords': [0, 3], 'water': 0}
+
+
+def test_grade_file_records_errors(tmp_path):
+    write_programs(tmp_path, {'bad.py': "x = (\n",
+                              'crash.py': "x = 1 / 0\n"})
+    for name in ('bad.py', 'crash.py'):
+        result = batch_grader.grade_file(str(tmp_path / name))
+        assert result['success'] is False
+        assert result['errors']
+
+
+def test_a_stuck_program_is_killed_and_the_rest_are_graded(tmp_path):
+    # a single huge calculation can't be stopped by the interpreter
+    write_programs(tmp_path, {'a.py': "x = 1\n",
+                              'b.py': "x = 10 ** 10 ** 9\n",
+                              'c.py': "x = 2\n"})
+    output = tmp_path / 'results.jsonl'
+    count = batch_grader.grade_folder(str(tmp_path), str(output),
+                                      processes=2, wall_clock_limit=2)
+    assert count == 3
+    results = read_results(output)
+    assert [result['file'] for result in results] == ['a.py', 'b.py',
+                                                       'c.py']
+    assert [result['success'] for result in results] == [True, False, True]
+    assert 'stopped after 2 seconds' in results[1]['errors'][0]
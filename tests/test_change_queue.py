@@ -0,0 +1,78 @@
+""" ChangeQueue: collecting and merging changes to the furrows """
+from change_queue import ChangeQueue
+
+
+class Thing:
+    # stands in for a furrow or a plot, which are only used as keys
+    pass
+
+
+def test_changes_come_out_in_order():
+    changes = ChangeQueue()
+    furrow = Thing()
+    changes.put(furrow, 0, 'plot', None, 'a')
+    changes.put(furrow, 1, 'plot', None, 'b')
+    assert len(changes) == 2
+    assert [(c.index, c.new) for c in changes.drain()] == [(0, 'a'),
+                                                           (1, 'b')]
+    assert len(changes) == 0
+    assert changes.drain() == []
+
+
+def test_repeated_changes_are_merged():
+    changes = ChangeQueue()
+    furrow, plot = Thing(), Thing()
+    for water in range(1, 101):
+        changes.put(furrow, 3, 'water', water - 1, water, plot)
+    [change] = changes.drain()
+    assert (change.old, change.new) == (0, 100)
+    assert change.plot is plot
+
+
+def test_different_fields_are_kept_apart():
+    changes = ChangeQueue()
+    furrow, plot = Thing(), Thing()
+    changes.put(furrow, 0, 'water', 0, 1, plot)
+    changes.put(furrow, 0, 'bugs', 0, 1, plot)
+    assert [c.field for c in changes.drain()] == ['water', 'bugs']
+
+
+def test_plot_changes_are_merged_by_plot():
+    # a plot that has moved in its furrow is still the same plot
+    changes = ChangeQueue()
+    furrow, plot, other_plot = Thing(), Thing(), Thing()
+    changes.put(furrow, 0, 'water', 0, 1, plot)
+    changes.put(furrow, 5, 'water', 1, 2, plot)
+    changes.put(furrow, 0, 'water', 0, 3, other_plot)
+    merged, other = changes.drain()
+    assert (merged.index, merged.old, merged.new) == (5, 0, 2)
+    assert other.plot is other_plot
+
+
+def test_furrow_changes_are_merged_by_position():
+    changes = ChangeQueue()
+    furrow, other_furrow = Thing(), Thing()
+    changes.put(furrow, 2, 'plot', 'a', 'b')
+    changes.put(furrow, 2, 'plot', 'b', 'c')
+    changes.put(other_furrow, 2, 'plot', 'x', 'y')
+    merged, other = changes.drain()
+    assert (merged.old, merged.new) == ('a', 'c')
+    assert other.furrow is other_furrow
+
+
+def test_the_latest_read_comes_last():
+    changes = ChangeQueue()
+    furrow = Thing()
+    changes.put(furrow, 0, 'read', None, 'a')
+    changes.put(furrow, 1, 'read', None, 'b')
+    changes.put(furrow, 0, 'read', None, 'a')
+    assert [c.index for c in changes.drain()] == [1, 0]
+
+
+def test_the_listener_hears_every_change():
+    heard = []
+    changes = ChangeQueue(lambda: heard.append(len(changes)))
+    furrow = Thing()
+    changes.put(furrow, 0, 'plot', None, 'a')
+    changes.put(furrow, 0, 'plot', 'a', 'b')
+    assert heard == [1, 1]
@@ -0,0 +1,126 @@
+""" FarmSimulation: growth, drying out and bug spread """
+import pytest
+
+from config import *
+from farm_simulation import FarmSimulation
+from furrow import Furrow, PlotStore
+from point import Point
+
+
+@pytest.fixture
+def farm():
+    # two furrows side by side, sharing a store
+    store = PlotStore()
+    furrows = [Furrow('row1', Point(0, 0), Point(4, 0), store=store),
+               Furrow('row2', Point(0, 1), Point(4, 1), store=store)]
+    return store, furrows
+
+
+def test_steps_are_run_at_a_fixed_rate(farm):
+    store, furrows = farm
+    simulation = FarmSimulation(store, step=0.5)
+    simulation.advance(0.3)
+    assert simulation.steps == 0
+    simulation.advance(0.3)
+    assert simulation.steps == 1
+    simulation.advance(1.0)
+    assert simulation.steps == 3
+
+
+def test_a_long_pause_is_skipped(farm):
+    store, furrows = farm
+    simulation = FarmSimulation(store, step=0.5, max_steps=10)
+    simulation.advance(100)
+    assert simulation.steps == 10
+    assert simulation.time_owed == 0
+
+
+def test_wet_plots_grow_and_dry_out(farm):
+    store, furrows = farm
+    plot = furrows[0][2]
+    plot.water = EVAPORATION * 2
+    simulation = FarmSimulation(store)
+    assert simulation.tick() == []
+    assert plot.water == pytest.approx(EVAPORATION)
+    assert plot.growth == pytest.approx(GROWTH_RATE * EVAPORATION * 2)
+    # the slot is reported on the step that it dries out
+    assert simulation.tick() == [plot.slot]
+    assert plot.water == 0
+    growth = plot.growth
+    simulation.tick()
+    assert plot.growth == growth
+
+
+def test_fertiliser_boosts_growth_and_is_used_up(farm):
+    store, furrows = farm
+    plain, fertilised = furrows[0][0], furrows[0][1]
+    for plot in (plain, fertilised):
+        plot.water = 1
+    fertilised.fertiliser = 1
+    FarmSimulation(store).tick()
+    assert fertilised.growth == pytest.approx(plain.growth
+                                              * (1 + FERTILISER_BOOST))
+    assert fertilised.fertiliser == pytest.approx(1 - FERTILISER_USE)
+    assert plain.fertiliser == 0
+
+
+def test_growth_is_limited_to_one(farm):
+    store, furrows = farm
+    plot = furrows[0][0]
+    plot.water = 1
+    plot.growth = 1
+    FarmSimulation(store).tick()
+    assert plot.growth == 1
+
+
+def test_negative_water_is_left_alone(farm):
+    store, furrows = farm
+    plot = furrows[0][0]
+    plot.water = -1
+    FarmSimulation(store).tick()
+    assert plot.water == -1
+    assert plot.growth == 0
+
+
+def test_bugs_spread_to_the_four_neighbours(farm):
+    store, furrows = farm
+    furrows[0][2].bugs = 1
+    FarmSimulation(store).tick()
+    bugs = [[plot.bugs for plot in furrow] for furrow in furrows]
+    assert bugs == [[0, BUG_SPREAD, 1, BUG_SPREAD, 0],
+                    [0, 0, BUG_SPREAD, 0, 0]]
+
+
+def test_bugs_spread_from_the_start_of_the_step(farm):
+    # a plot that gains bugs in a step doesn't pass them on until the next
+    store, furrows = farm
+    furrows[0][0].bugs = 1
+    simulation = FarmSimulation(store)
+    simulation.tick()
+    assert furrows[0][2].bugs == 0
+    simulation.tick()
+    assert furrows[0][2].bugs == pytest.approx(BUG_SPREAD * BUG_SPREAD)
+
+
+def test_bugs_slow_growth(farm):
+    store, furrows = farm
+    healthy, infested = furrows[0][0], furrows[0][4]
+    for plot in (healthy, infested):
+        plot.water = 1
+    infested.bugs = 1
+    FarmSimulation(store).tick()
+    assert infested.growth == pytest.approx(healthy.growth
+                                            * (1 - BUG_DAMAGE))
+
+
+def test_plots_added_later_are_simulated(farm):
+    store, furrows = farm
+    simulation = FarmSimulation(store)
+    furrows[0][0].bugs = 1
+    simulation.tick()
+    new_furrow = Furrow('row3', Point(0, 2), Point(4, 2), store=store)
+    new_furrow[0].water = 1
+    furrows[1][0].bugs = 1
+    simulation.tick()
+    assert new_furrow[0].growth > 0
+    assert new_furrow[0].bugs == pytest.approx(BUG_SPREAD)
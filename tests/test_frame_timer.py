@@ -0,0 +1,92 @@
+""" FrameTimer: timing the phases of the game loop """
+import pytest
+
+import frame_timer
+from frame_timer import FrameTimer
+
+
+class Clock:
+    # a stand-in for time.perf_counter() that only moves when told to
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, ms):
+        self.now += ms / 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frame_timer.time, 'perf_counter', clock)
+    return clock
+
+
+def run_frame(timer, clock, **phases):
+    # one frame, spending the given number of ms in each phase
+    timer.start_frame()
+    for name, ms in phases.items():
+        timer.start_phase(name)
+        clock.wait(ms)
+    timer.end_frame()
+
+
+def test_phases_are_averaged_per_frame(clock):
+    timer = FrameTimer(history=10, report_interval=0)
+    run_frame(timer, clock, program=4, render=6)
+    run_frame(timer, clock, program=8, render=2)
+    assert timer.frames == 2
+    assert timer.get_phase_average('program') == pytest.approx(6)
+    assert timer.get_phase_average('render') == pytest.approx(4)
+    assert timer.get_phase_average('input') == 0
+    assert timer.get_fps() == pytest.approx(100)
+
+
+def test_a_phase_missed_in_a_frame_counts_as_zero(clock):
+    timer = FrameTimer(history=10, report_interval=0)
+    run_frame(timer, clock, program=10)
+    run_frame(timer, clock, render=10)
+    assert timer.get_phase_average('program') == pytest.approx(5)
+    assert timer.get_phase_average('render') == pytest.approx(10)
+
+
+def test_only_recent_frames_are_kept(clock):
+    timer = FrameTimer(history=3, report_interval=0)
+    for ms in (100, 10, 10, 10):
+        run_frame(timer, clock, render=ms)
+    assert list(timer.frame_times) == pytest.approx([10, 10, 10])
+    assert timer.get_phase_average('render') == pytest.approx(10)
+
+
+def test_percentiles_and_histogram(clock):
+    timer = FrameTimer(history=20, report_interval=0)
+    for ms in (5, 10, 16, 20, 40, 60, 200):
+        run_frame(timer, clock, render=ms)
+    assert timer.get_percentile(0) == pytest.approx(5)
+    assert timer.get_percentile(100) == pytest.approx(200)
+    # <8, <17, <33, <50, <100 and anything longer
+    assert timer.get_histogram() == [1, 2, 1, 1, 1, 1]
+
+
+def test_no_frames(clock):
+    timer = FrameTimer(report_interval=0)
+    timer.end_frame()  # without a start_frame(), this is ignored
+    assert timer.frames == 0
+    assert timer.get_fps() == 0
+    assert timer.get_percentile(95) == 0
+    assert timer.report().startswith('0.0 fps')
+
+
+def test_a_report_is_logged_every_interval(clock, monkeypatch):
+    logged = []
+    monkeypatch.setattr(frame_timer, 'console_msg',
+                        lambda message, verbosity: logged.append(message))
+    timer = FrameTimer(history=10, report_interval=2)
+    run_frame(timer, clock, program=10)
+    assert logged == []
+    run_frame(timer, clock, program=10)
+    assert logged == ['100.0 fps, 95% < 10.0ms, worst 10.0ms'
+                      ' | program 10.0 | <8:0 <17:2 <33:0 <50:0 <100:0'
+                      ' >100:0']
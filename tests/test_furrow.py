@@ -0,0 +1,154 @@
+""" Furrow, and how it reports changes to the ChangeQueue """
+from change_queue import ChangeQueue
+from furrow import Furrow, GrowingPlot
+from point import Point
+
+
+def make_furrow(length=6):
+    changes = ChangeQueue()
+    changes.track_reads = False
+    furrow = Furrow('row1', Point(0, 3), Point(length - 1, 3), changes)
+    return furrow, changes
+
+
+def plot_changes(changes):
+    # (index, new element) for each 'plot' change, in order
+    return [(change.index, change.new) for change in changes.drain()
+            if change.field == 'plot']
+
+
+def check_positions(furrow):
+    # every plot in the furrow knows where it is
+    for index, element in enumerate(furrow):
+        if isinstance(element, GrowingPlot):
+            assert element.furrow is furrow
+            assert element.index == index
+
+
+def test_building_a_furrow_reports_nothing():
+    furrow, changes = make_furrow()
+    assert len(furrow) == 6
+    assert len(changes) == 0
+    check_positions(furrow)
+
+
+def test_setting_an_element_reports_it():
+    furrow, changes = make_furrow()
+    plot = furrow[2]
+    furrow[2] = 'rock'
+    assert plot_changes(changes) == [(2, 'rock')]
+    assert plot.index is None
+    assert furrow.get_tile(2) == Point(2, 3)
+
+
+def test_append_reports_the_new_position():
+    furrow, changes = make_furrow()
+    furrow.append(1)
+    assert plot_changes(changes) == [(6, 1)]
+    assert furrow.get_tile(6) is None
+
+
+def test_pop_reports_the_emptied_position():
+    furrow, changes = make_furrow()
+    plot = furrow.pop()
+    assert plot_changes(changes) == [(5, None)]
+    assert plot.index is None
+    # the farmer can still go to where it was
+    assert furrow.get_tile(5) == Point(5, 3)
+
+
+def test_pop_from_the_front_moves_the_rest():
+    furrow, changes = make_furrow()
+    plots = list(furrow)
+    furrow.pop(0)
+    assert plot_changes(changes) == [(0, plots[1]), (1, plots[2]),
+                                     (2, plots[3]), (3, plots[4]),
+                                     (4, plots[5]), (5, None)]
+    check_positions(furrow)
+
+
+def test_deleting_the_last_element_reports_it():
+    furrow, changes = make_furrow()
+    del furrow[-1]
+    assert plot_changes(changes) == [(5, None)]
+
+
+def test_removing_the_last_element_reports_it():
+    furrow, changes = make_furrow()
+    furrow.remove(furrow[-1])
+    assert plot_changes(changes) == [(5, None)]
+
+
+def test_clear_reports_every_position():
+    furrow, changes = make_furrow()
+    plots = list(furrow)
+    furrow.clear()
+    assert plot_changes(changes) == [(index, None) for index in range(6)]
+    assert all(plot.index is None for plot in plots)
+
+
+def test_multiplying_by_zero_reports_every_position():
+    furrow, changes = make_furrow()
+    furrow *= 0
+    assert len(furrow) == 0
+    assert plot_changes(changes) == [(index, None) for index in range(6)]
+
+
+def test_shortening_with_a_slice_reports_the_emptied_positions():
+    furrow, changes = make_furrow()
+    furrow[2:] = ['rock']
+    assert plot_changes(changes) == [(2, 'rock'), (3, None), (4, None),
+                                     (5, None)]
+
+
+def test_plots_keep_their_tiles_when_the_furrow_is_reversed():
+    furrow, changes = make_furrow()
+    furrow.reverse()
+    check_positions(furrow)
+    assert [plot.coords.x for plot in furrow] == [5, 4, 3, 2, 1, 0]
+    assert len(plot_changes(changes)) == 6
+
+
+def test_watering_a_plot_reports_the_plot():
+    furrow, changes = make_furrow()
+    plot = furrow[1]
+    furrow.reverse()
+    changes.drain()
+    plot.water = 1
+    plot.water = 2
+    [change] = changes.drain()
+    # the change follows the plot, not the position it started in
+    assert (change.index, change.field, change.old, change.new) \
+        == (4, 'water', 0, 2)
+    assert change.plot is plot
+
+
+def read_changes(changes):
+    # (index, element) for each read, in order
+    return [(change.index, change.new) for change in changes.drain()
+            if change.field == 'read']
+
+
+def test_reading_an_element_reports_it():
+    furrow, changes = make_furrow()
+    changes.track_reads = True
+    plot = furrow[-2]
+    assert read_changes(changes) == [(4, plot)]
+
+
+def test_iterating_reports_each_element():
+    furrow, changes = make_furrow()
+    changes.track_reads = True
+    plots = [plot for plot in furrow]
+    assert read_changes(changes) == list(enumerate(plots))
+
+
+def test_slices_and_untracked_reads_are_not_reported():
+    furrow, changes = make_furrow()
+    changes.track_reads = True
+    furrow[1:3]
+    furrow.get_all()
+    changes.track_reads = False
+    furrow[0]
+    list(furrow)
+    assert len(changes) == 0
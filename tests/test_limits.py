@@ -0,0 +1,47 @@
+""" the limits that stop runaway student programs """
+import time
+
+import pytest
+
+# the interpreter needs the rest of the game to be importable
+headless = pytest.importorskip('headless')
+
+
+@pytest.fixture
+def world():
+    return headless.HeadlessWorld()
+
+
+def test_appending_to_a_furrow_is_limited(world):
+    world.farmer.python_interpreter.max_list_size = 1000
+    success, errors = world.run_program(["while True:",
+                                         "    row1.append(1)"])
+    assert success is False
+    assert 'more than 1000 items' in errors[0]
+    assert len(world.furrows[0]) == 1001
+
+
+def test_adding_to_a_furrow_is_limited(world):
+    world.farmer.python_interpreter.max_list_size = 1000
+    success, errors = world.run_program(["while True:",
+                                         "    row1 += row1"])
+    assert success is False
+    assert 'more than 1000 items' in errors[0]
+
+
+def test_time_in_nested_calls_is_counted_once(world):
+    # each call to nest() runs inside map(), and so in its own
+    # run_frame(), ten deep
+    vm = world.farmer.python_interpreter
+    started = time.perf_counter()
+    success, result = world.run_program(
+        ["def nest(depth):",
+         "    if depth == 0:",
+         "        for i in range(100000):",
+         "            pass",
+         "        return 0",
+         "    return list(map(nest, [depth - 1]))[0]",
+         "nest(10)"])
+    elapsed = time.perf_counter() - started
+    assert success is True
+    assert 0 < vm.run_time <= elapsed
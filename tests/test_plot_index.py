@@ -0,0 +1,54 @@
+""" PlotIndex: finding the plot on a tile """
+import pytest
+
+from furrow import Furrow, PlotStore
+from plot_index import PlotIndex, TileContents
+from point import Point
+
+
+@pytest.fixture
+def farm():
+    store = PlotStore()
+    furrows = [Furrow('row1', Point(0, 3), Point(5, 3), store=store),
+               Furrow('row2', Point(0, 5), Point(5, 5), store=store)]
+    return furrows, PlotIndex(furrows)
+
+
+def test_every_plot_is_indexed(farm):
+    furrows, index = farm
+    assert len(index) == 12
+    assert Point(2, 5) in index
+    assert Point(2, 4) not in index
+    assert set(index) == furrows[0].tiles_coords | furrows[1].tiles_coords
+
+
+def test_a_tile_gives_its_furrow_and_position(farm):
+    furrows, index = farm
+    assert index.get(Point(2, 5)) == TileContents(furrows[1], 2,
+                                                  furrows[1][2])
+    assert index.get(Point(2, 4)) is None
+
+
+def test_positions_are_current_after_the_furrow_is_rearranged(farm):
+    furrows, index = farm
+    row1 = furrows[0]
+    row1.reverse()
+    contents = index.get(Point(0, 3))
+    assert contents.index == 5
+    assert row1[contents.index] is contents.plot
+    row1.pop(0)
+    assert index.get(Point(0, 3)).index == 4
+
+
+def test_a_plot_taken_out_of_its_furrow_has_no_position(farm):
+    furrows, index = farm
+    plot = furrows[0].pop(1)
+    assert index.get(Point(1, 3)) == TileContents(None, None, plot)
+
+
+def test_furrows_can_be_removed(farm):
+    furrows, index = farm
+    index.remove_furrow(furrows[0])
+    assert len(index) == 6
+    assert index.get(Point(0, 3)) is None
+    assert index.get(Point(0, 5)) is not None
@@ -0,0 +1,68 @@
+""" PlotStore, and the GrowingPlot views onto it """
+import pytest
+
+from furrow import Furrow, GrowingPlot, PlotStore
+from point import Point
+
+
+def test_new_plots_start_empty():
+    store = PlotStore()
+    slots = store.add_plots([Point(3, 4), Point(5, 6)])
+    assert list(slots) == [0, 1]
+    assert store.add(Point(7, 8)) == 2
+    assert len(store) == 3
+    assert store.get_coords(1) == Point(5, 6)
+    for name in PlotStore.COLUMNS:
+        assert list(getattr(store, name)) == [0, 0, 0]
+
+
+def test_a_plot_reads_and_writes_its_slot():
+    store = PlotStore()
+    store.add(Point(0, 0))
+    store.add(Point(1, 0))
+    plot = GrowingPlot(store, 1)
+    plot.water = 2.5
+    assert store.water[1] == 2.5
+    assert store.water[0] == 0
+    store.fertiliser[1] = 0.25
+    assert plot.fertiliser == 0.25
+    assert plot.coords == Point(1, 0)
+
+
+def test_whole_numbers_are_read_as_ints():
+    store = PlotStore()
+    plot = GrowingPlot(store, store.add(Point(0, 0)))
+    plot.growth = 3
+    assert plot.growth == 3
+    assert type(plot.growth) is int
+    plot.growth = 0.5
+    assert type(plot.growth) is float
+
+
+def test_plots_only_hold_numbers():
+    store = PlotStore()
+    plot = GrowingPlot(store, store.add(Point(0, 0)))
+    with pytest.raises(TypeError):
+        plot.water = 'lots'
+    with pytest.raises(TypeError):
+        plot.water = '3'
+    assert plot.water == 0
+
+
+def test_furrows_can_share_a_store():
+    store = PlotStore()
+    row1 = Furrow('row1', Point(0, 0), Point(2, 0), store=store)
+    row2 = Furrow('row2', Point(0, 1), Point(2, 1), store=store)
+    assert len(store) == 6
+    assert list(row2.plot_slots) == [3, 4, 5]
+    row2[0].water = 1
+    assert store.water[3] == 1
+    assert row1[0].water == 0
+    assert [row2.get_coords(i) for i in range(3)] \
+        == [Point(0, 1), Point(1, 1), Point(2, 1)]
+
+
+def test_plots_are_small():
+    # the plot views have no __dict__, which keeps big farms cheap
+    plot = GrowingPlot(PlotStore(), 0)
+    assert not hasattr(plot, '__dict__')
@@ -0,0 +1,120 @@
+# The grid of terrain tiles, viewed from any of four orientations
+from array import array
+
+from config import *
+
+
+class TileGrid:
+    """ stores a tile ID (0-255) per tile, in a single flat byte array.
+    What each ID looks like is up to the owner of the grid (see the
+    palette in Terrain).
+    Extra per-tile values (eg moisture) can be stored in named layers,
+    which are arrays of the same size.
+    The grid can be viewed from four orientations (quarter turns).
+    Rotating doesn't move any data: it just changes how (row, col) in the
+    current view is mapped onto the stored tiles.
+    Base coordinates are the (row, col) of a tile in the original,
+    unrotated grid, and these never change. """
+
+    def __init__(self, rows, cols, fill=0):
+        self.base_rows = rows
+        self.base_cols = cols
+        self._tiles = array('B', [fill]) * (rows * cols)  # row by row
+        self.layers = {}  # name: array of per-tile values
+        self.rotation = 0  # number of quarter turns
+
+    def rotate(self):
+        # turn the view through 90 degrees
+        self.rotation = (self.rotation + 1) % 4
+
+    def get_rows(self) -> int:
+        # number of rows in the current view
+        if self.rotation % 2:
+            return self.base_cols
+        return self.base_rows
+
+    def get_cols(self) -> int:
+        # number of cols in the current view
+        if self.rotation % 2:
+            return self.base_rows
+        return self.base_cols
+
+    def to_base(self, row, col, rotation=None) -> Point:
+        # converts (row, col) in a view to base coordinates
+        # each quarter turn maps (row, col) to (rows - 1 - col, row)
+        # of the view before it
+        if rotation is None:
+            rotation = self.rotation
+        last_row = self.base_rows - 1
+        last_col = self.base_cols - 1
+        if rotation == 0:
+            return Point(row, col)
+        elif rotation == 1:
+            return Point(last_row - col, row)
+        elif rotation == 2:
+            return Point(last_row - row, last_col - col)
+        else:
+            return Point(col, last_col - row)
+
+    def from_base(self, base_position: Point, rotation=None) -> Point:
+        # converts base coordinates to (row, col) in a view
+        if rotation is None:
+            rotation = self.rotation
+        base_row, base_col = base_position
+        last_row = self.base_rows - 1
+        last_col = self.base_cols - 1
+        if rotation == 0:
+            return Point(base_row, base_col)
+        elif rotation == 1:
+            return Point(base_col, last_row - base_row)
+        elif rotation == 2:
+            return Point(last_row - base_row, last_col - base_col)
+        else:
+            return Point(last_col - base_col, base_row)
+
+    def get(self, row, col):
+        # the tile at (row, col) in the current view
+        base_row, base_col = self.to_base(row, col)
+        return self._tiles[base_row * self.base_cols + base_col]
+
+    def get_base(self, base_position: Point):
+        return self._tiles[base_position[0] * self.base_cols
+                           + base_position[1]]
+
+    def set_base(self, base_position: Point, tile_id):
+        self._tiles[base_position[0] * self.base_cols
+                    + base_position[1]] = tile_id
+
+    def count(self, tile_id) -> int:
+        # number of tiles with this ID
+        return self._tiles.count(tile_id)
+
+    def translate(self, new_ids) -> int:
+        # change every tile with an ID in the new_ids dict to its new ID
+        # eg {1: 2} changes all 1s to 2s
+        # This is done in one pass over the raw bytes,
+        # rather than tile by tile.
+        # Returns the number of tiles changed
+        changed = sum(self._tiles.count(old_id) for old_id in new_ids)
+        if changed:
+            table = bytearray(range(256))
+            for old_id, new_id in new_ids.items():
+                table[old_id] = new_id
+            self._tiles = array('B', self._tiles.tobytes().translate(table))
+        return changed
+
+    def add_layer(self, name, typecode='B', fill=0) -> array:
+        # creates an array to store an extra value for every tile
+        # typecode is as for the array module, eg 'B' for 0-255
+        # or 'f' for decimals
+        layer = array(typecode, [fill]) * (self.base_rows * self.base_cols)
+        self.layers[name] = layer
+        return layer
+
+    def get_layer_value(self, name, base_position: Point):
+        return self.layers[name][base_position[0] * self.base_cols
+                                 + base_position[1]]
+
+    def set_layer_value(self, name, base_position: Point, value):
+        self.layers[name][base_position[0] * self.base_cols
+                          + base_position[1]] = value
@@ -1,25 +1,44 @@
+from functools import partial
 from math import copysign
+from animator import Animator
 import characters
+from camera import quantise_zoom
+from change_queue import ChangeQueue
 from config import *
 from console_messages import console_msg
 from dummy_session import DummySession
-from furrow import Furrow
+from farm_simulation import FarmSimulation
+from furrow import Furrow, GrowingPlot, PlotStore
 from panel import Panel
+from plot_index import PlotIndex
+from surface_cache import SurfaceCache
 import point
 from terrain import Terrain
 from talking_head import TalkingHead
 from farm_editor import FarmCodeWindow
+from frame_timer import FrameTimer
 
 
 class World:
     def __init__(self, screen):
         console_msg('Initialising world', 0)
         self.display = screen
-        self.zoom = 0.6
+        self.headless = False  # see HeadlessWorld
+        self.zoom = quantise_zoom(0.6)
 
         # starting plots for the terrain
         # eventually this will come from a level map or something
-        self.furrows = [Furrow('row1', Point(0,3), Point(5,3))]
+        # anything the program does to them is collected in self.changes
+        # and shown on screen once per frame
+        # the state of every plot is kept together in self.plots
+        # self.plot_index finds the plot on any tile
+        self.changes = ChangeQueue()
+        self.plots = PlotStore()
+        self.plot_index = PlotIndex()
+        self.furrows = []
+        self.add_furrow('row1', Point(0,3), Point(5,3))
+        # plants grow and the ground dries out as time passes
+        self.simulation = FarmSimulation(self.plots)
 
         self.terrain = Terrain(screen, 5, 8, self.zoom,
                                self.get_all_cultivated())
@@ -42,6 +61,10 @@ class World:
                                        Point(2,4),
                                        self.zoom,
                                        self.furrows)
+        # the farmer acts out changes to the furrows, one at a time
+        self.animator = Animator(self.farmer)
+        self.set_fast_forward(ANIMATION_FAST_FORWARD)
+        self.changes.listener = self.on_furrow_change
 
         # load fonts
         if pygame.font.get_init() is False:
@@ -65,33 +88,215 @@ class World:
         self.running = True
         self.frame_counter = 0
         self.clock = pygame.time.Clock()
+        self.frame_timer = FrameTimer()
+        # what was on screen last frame, to work out what has changed
+        self.last_view = None
+        self.last_layers = {}
+        self.changed_layers = set()
+        # partly transparent copies of sprites, see blit_alpha()
+        self.faded_sprites = SurfaceCache(SPRITE_CACHE_PIXELS)
 
     def blit_alpha(self, target, source, location, opacity):
-        x = location[0]
-        y = location[1]
-        temp = pygame.Surface((source.get_width(), source.get_height())).convert()
-        temp.blit(target, (-x, -y))
-        temp.blit(source, (0, 0))
-        temp.set_alpha(opacity)
-        target.blit(temp, location)
+        # draw a sprite with the given opacity (0-255)
+        # fully opaque sprites don't need any special treatment
+        if opacity >= 255:
+            target.blit(source, location)
+            return
+        # otherwise use a copy of the sprite with its surface alpha set
+        # these are cached, so a sprite fading in or out doesn't need a
+        # new surface every frame
+        key = (source, opacity)
+        faded = self.faded_sprites.get(key)
+        if faded is None:
+            faded = source.copy()
+            faded.set_alpha(opacity, pygame.RLEACCEL)
+            self.faded_sprites.put(key, faded)
+        target.blit(faded, location)
 
     def update(self):
+        self.frame_timer.start_frame()
         # handle mouse and keyboard events
+        self.frame_timer.start_phase('input')
+        had_events = pygame.event.peek()
         self.check_keyboard_and_mouse()
 
+        # let the farmer's program run for a while
+        # the interpreter is only ever advanced from here, so that
+        # the game loop stays in control of the frame rate
+        self.frame_timer.start_phase('program')
+        self.farmer.update()
+        self.show_changes()
+        self.frame_timer.start_phase('animation')
+        self.animator.update(self.clock.get_time() / 1000)
+
+        # move the farm on by however long the last frame took
+        self.frame_timer.start_phase('simulation')
+        for slot in self.simulation.advance(self.clock.get_time() / 1000):
+            # this plot has dried out
+            self.terrain.set_tile(self.plots.get_coords(slot), BROWN)
+
         # render all onscreen objects
-        self.display.fill(SKY_BLUE)
-        landscape = self.terrain.update(self.viewpoint)
-        offset_position = Point(self.display.get_width()
-                                - landscape.get_width() // 2
-                                - self.viewpoint.x,
-                                self.display.get_height()
-                                - landscape.get_height() // 2
-                                - self.viewpoint.y)
-
-        self.display.blit(landscape, offset_position)
-        # calculate the pixel coords of the farmer's grid tile
+        # only the areas of the screen that have changed are redrawn,
+        # and if nothing has changed the frame is skipped entirely
+        self.frame_timer.start_phase('render')
+        offset_position = self.terrain.get_origin(self.viewpoint)
+        layers = self.get_layers(offset_position)
+        if had_events or self.farmer.python_interpreter.is_running():
+            # the editor might have changed, either from typing
+            # or highlighting the line being run
+            layers['editor'] = (layers['editor'][0], self.frame_counter)
+        dirty_rects = self.get_dirty_rects(offset_position, layers)
+        if dirty_rects:
+            if 'editor' in self.changed_layers:
+                self.editor.draw()
+            for rect in dirty_rects:
+                self.display.set_clip(rect)
+                self.draw_layers(offset_position, layers)
+            self.display.set_clip(None)
+            self.frame_timer.start_phase('flip')
+            pygame.display.update(dirty_rects)
+            self.frame_timer.start_phase('wait')
+            self.clock.tick(TARGET_FPS)
+        else:
+            # idle, so don't hog the CPU
+            self.frame_timer.start_phase('wait')
+            self.clock.tick(IDLE_FPS)
+        self.frame_timer.end_frame()
+
+        self.frame_counter += 1
+        if self.frame_counter > 200:
+            self.frame_counter = 0
+
+    def show_changes(self):
+        # queue up the farmer's actions for whatever the program has
+        # done to the furrows since the last frame. The farmer walks to
+        # each change, and a plot's tile changes when they get there
+        for change in self.changes.drain():
+            if change.plot is not None:
+                # a plot has changed, eg it has been watered
+                coords = change.plot.coords
+                self.animator.move(self.farmer.get_tending_position(coords))
+                self.animator.act(change.field, coords,
+                                  partial(self.terrain.set_tile, coords,
+                                          self.get_plot_colour(change.plot)))
+            elif isinstance(change.new, GrowingPlot):
+                # a plot has been read, or moved in its furrow
+                # the plots themselves stay on their own tiles
+                self.animator.move(
+                    self.farmer.get_tending_position(change.new.coords))
+            else:
+                # something other than a plot has been read or put in the
+                # furrow, or the end of the furrow has been removed, so go
+                # to that place in the furrow
+                coords = change.furrow.get_tile(change.index)
+                if coords is not None:
+                    self.animator.move(
+                        self.farmer.get_tending_position(coords))
+
+    def on_furrow_change(self):
+        # called as soon as the program changes a furrow
+        # the program can carry on until the farmer has a few actions
+        # to catch up on, then it hands control back to the game loop
+        # (and waits, see busy())
+        if self.animator.fast_forward:
+            return
+        if len(self.changes) + len(self.animator) >= ANIMATION_PIPELINE:
+            self.farmer.python_interpreter.request_update()
+
+    def set_fast_forward(self, on):
+        # when skipping the animations, the farmer doesn't need to follow
+        # what the program reads, so the furrows needn't report it
+        self.animator.fast_forward = on
+        self.changes.track_reads = not on
+
+    def get_plot_colour(self, plot):
+        # the terrain colour for a plot, depending on its contents
+        if plot.water > 0:
+            return WET_SOIL
+        return BROWN
+
+    def get_layers(self, offset_position):
+        # returns the screen rect of everything drawn on top of the
+        # terrain, together with a value that changes whenever the
+        # layer's contents do
+        layers = {}
         sprite = self.farmer.get_sprite()
+        farmer_rect = sprite.get_rect(topleft=self.get_farmer_position(
+            sprite, offset_position))
+        layers['farmer'] = (farmer_rect, id(sprite))
+        if self.farmer.speaking:
+            bubble = self.farmer.get_speech_bubble()
+            position = point.add_points(Point(*farmer_rect.topleft),
+                                        self.farmer.get_speech_bubble_offset())
+            # if self.farmer.facing_right:
+            #     position[X] += ???  # to put the callout spike next to his mouth
+            layers['speech'] = (bubble.get_rect(topleft=position),
+                                self.farmer.speech_version)
+        layers['basket'] = (self.basket.get_rect(), self.basket.version)
+        editor_rect = pygame.Rect(self.editor_position,
+                                  (self.editor.width, self.editor.height))
+        # the editor is only redrawn when it has been given some input
+        layers['editor'] = (editor_rect, None)
+        return layers
+
+    def get_dirty_rects(self, offset_position, layers):
+        # works out which areas of the screen need redrawing, by comparing
+        # each layer with the last frame. Returns an empty list if
+        # nothing has changed.
+        # Panning, zooming or rotating changes everything
+        view = (offset_position, self.terrain.block_size,
+                self.terrain.rotation, self.display.get_size())
+        terrain_rects = self.terrain.take_dirty_rects()
+        if view != self.last_view or terrain_rects is None:
+            self.last_view = view
+            self.last_layers = layers
+            self.changed_layers = set(layers)
+            return [self.display.get_rect()]
+
+        dirty_rects = [rect.move(offset_position) for rect in terrain_rects]
+        self.changed_layers = set()
+        for name, (rect, contents) in layers.items():
+            if self.last_layers.get(name) != (rect, contents):
+                self.changed_layers.add(name)
+                dirty_rects.append(rect)
+                if name in self.last_layers:
+                    dirty_rects.append(self.last_layers[name][0])
+        for name in self.last_layers:
+            if name not in layers:  # eg the speech bubble has gone
+                dirty_rects.append(self.last_layers[name][0])
+        self.last_layers = layers
+
+        # lots of small rects can be slower than one big one
+        # so if the changes cover much of the screen, redraw the lot
+        screen_area = self.display.get_width() * self.display.get_height()
+        if sum(r.width * r.height for r in dirty_rects) > screen_area // 2:
+            return [self.display.get_rect()]
+        return dirty_rects
+
+    def draw_layers(self, offset_position, layers):
+        # draws everything, from back to front
+        # this is clipped to the area being redrawn
+        self.terrain.update(offset_position)
+        farmer_rect = layers['farmer'][0]
+        # self.display.blit(sprite, position,
+        #                   special_flags=pygame.BLEND_MULT)
+        self.blit_alpha(self.display, self.farmer.get_sprite(),
+                        farmer_rect.topleft, 255)
+        # DEBUG bounding box
+        if BOUNDING_BOX:  # used for debug
+            pygame.draw.rect(self.display, "red", farmer_rect, 2)
+
+        # draw any speech bubbles
+        if 'speech' in layers:
+            self.display.blit(self.farmer.get_speech_bubble(),
+                              layers['speech'][0])
+
+        #self.talking_head.update()
+        self.basket.update()
+        self.display.blit(self.editor.surface, self.editor_position)
+
+    def get_farmer_position(self, sprite, offset_position) -> Point:
+        # calculate the pixel coords of the farmer's grid tile
         raw_ground_position = self.terrain.get_ground_coords(self.farmer.position)
         # offset this position so the sprite appears to be standing
         # in the middle of the tile
@@ -105,36 +310,14 @@ class World:
                                   )
                                  )
         # add the viewpoint offset
-        final_position = point.add_points(sprite_position, offset_position)
-        # self.display.blit(sprite, position,
-        #                   special_flags=pygame.BLEND_MULT)
-        self.blit_alpha(self.display, sprite, final_position, 255)
-        # DEBUG bounding box
-        if BOUNDING_BOX:  # used for debug
-            box = pygame.Rect(final_position,
-                              (sprite.get_width(), sprite.get_height()))
-            pygame.draw.rect(self.display, "red", box, 2)
-
-        # draw any speech bubbles
-        if self.farmer.speaking:
-            position = point.add_points(final_position,
-                                        self.farmer.get_speech_bubble_offset())
+        return point.add_points(sprite_position, offset_position)
 
-            # if self.farmer.facing_right:
-            #     position[X] += ???  # to put the callout spike next to his mouth
-            self.display.blit(self.farmer.get_speech_bubble(), position)
-
-        #self.talking_head.update()
-        self.basket.update()
-        self.editor.draw()
-        self.display.blit(self.editor.surface, self.editor_position)
-        pygame.display.update()
-
-        self.clock.tick()
-        self.frame_counter += 1
-        if self.frame_counter > 200:  # to avoid slowdown due to fps spam
-            #print(int(self.clock.get_fps()))
-            self.frame_counter = 0
+    def get_tile_under_mouse(self):
+        # returns the grid coords of the tile under the mouse pointer,
+        # or None if it isn't over the terrain
+        return self.terrain.screen_to_grid(
+            (pygame.mouse.get_pos(),),
+            self.terrain.get_origin(self.viewpoint))[0]
 
     def mouse_over_editor(self) -> bool:
         # returns true if the mouse pointer is anywhere within the code pane
@@ -158,6 +341,9 @@ class World:
         if self.editor.is_active():
             self.editor.update()
         else:
+            # mouse wheel clicks are added up, so that a burst of them
+            # only changes the zoom once per frame
+            zoom_steps = 0
             for event in pygame.event.get():
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if pygame.mouse.get_pressed()[0]:  # LMB
@@ -169,16 +355,20 @@ class World:
                             self.old_viewpoint = self.viewpoint
                     elif pygame.mouse.get_pressed()[2]:  # right button
                         self.terrain.rotate()
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_f:
+                        # skip the farmer's animations, or stop skipping
+                        self.set_fast_forward(not self.animator.fast_forward)
                 elif event.type == pygame.MOUSEWHEEL:
                     if not self.editor.is_active():
-                        min_zoom = .1
-                        max_zoom = 10
-                        # adjust zoom level by +/- 10%
-                        self.zoom *= 1 + .1 * copysign(1, event.y)
-                        # constrain zoom between min_ and max_
-                        self.zoom = min(max(self.zoom, min_zoom), max_zoom)
-                        self.terrain.change_zoom(self.zoom)
-                        self.farmer.change_zoom(self.zoom)
+                        zoom_steps += copysign(1, event.y)
+
+            if zoom_steps:
+                # adjust zoom level by +/- 10% per click, snapped to the
+                # nearest zoom level and constrained between min and max
+                self.zoom = quantise_zoom(self.zoom * ZOOM_STEP ** zoom_steps)
+                self.terrain.change_zoom(self.zoom)
+                self.farmer.change_zoom(self.zoom)
 
             # check for ongoing mouse-drag
             if pygame.mouse.get_pressed()[0]:  # LMB held down
@@ -194,18 +384,27 @@ class World:
         This allows us to halt code execution while certain animations
         complete for example.
 
-        At the moment nothing triggers the busy state, but we
-        will probably want to set it when the farmer is completing an action
-        eg moving
+        The program is allowed to get a few actions ahead of the farmer
+        (ANIMATION_PIPELINE), so it only waits when the animator's queue
+        fills up
         """
+        return self.animator.busy()
+
+    def add_furrow(self, name, start: Point, end: Point) -> Furrow:
+        # creates a new furrow between the two tiles (inclusive)
+        furrow = Furrow(name, start, end, self.changes, self.plots)
+        self.furrows.append(furrow)
+        self.plot_index.add_furrow(furrow)
+        return furrow
 
-        return False
+    def plot_at(self, coords: Point):
+        # returns the (furrow, index, plot) on the tile at these grid
+        # coords, or None if it isn't cultivated
+        return self.plot_index.get(coords)
 
     def get_all_cultivated(self):
-        # returns a set of all tiles coordinates that are in one
-        # of the furrows
-        all_tiles = set()
-        for f in self.furrows:
-            for plot in f:
-                all_tiles.add(plot.coords)
-        return all_tiles
\ No newline at end of file
+        # returns the coordinates of all tiles that are in one of the
+        # furrows. The index supports 'in' and iterating over the coords
+        # just like the set that used to be built here, without having
+        # to visit every plot
+        return self.plot_index
\ No newline at end of file